@@ -13,13 +13,12 @@ import os
 from datetime import datetime, timedelta
 from typing import Dict, Any, List
 
-import numpy as np
-import pandas as pd
 import streamlit as st
 
 # ---------- Persistenz ----------
 
 DB_FILE = "watering_state.json"
+LOG_MAX_ENTRIES = 200   # pro Modul; ältere Einträge werden beim Schreiben verworfen
 
 def load_db() -> Dict[str, Any]:
     if os.path.exists(DB_FILE):
@@ -114,6 +113,7 @@ def find_module(db: Dict[str, Any], module_id: int) -> Dict[str, Any]:
 
 def add_log(module: Dict[str, Any], text: str) -> None:
     module["logs"].insert(0, {"ts": now_iso(), "text": text})
+    del module["logs"][LOG_MAX_ENTRIES:]
     module["updated_at"] = now_iso()
 
 def add_plant(module: Dict[str, Any], name: str) -> None:
@@ -204,6 +204,7 @@ def render_overview():
             plant_count = len(m["plants"])
             st.write(f"Pflanzen: {plant_count}/4")
             if m["plants"]:
+                import pandas as pd  # erst laden, wenn eine Tabelle gezeigt wird
                 df = pd.DataFrame([
                     {
                         "Pflanze": p["name"],
@@ -349,6 +350,7 @@ def render_module_details():
     st.markdown("---")
     st.subheader("Logs")
     if module["logs"]:
+        import pandas as pd
         df_log = pd.DataFrame(module["logs"])
         df_log["ts"] = pd.to_datetime(df_log["ts"])
         st.dataframe(df_log, use_container_width=True, hide_index=True)
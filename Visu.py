@@ -1,12 +1,19 @@
 import streamlit as st
-import pandas as pd
-import time
 import os
+import time
 from datetime import datetime
 
 # Import Backend (muss im selben Ordner liegen als backend.py)
 import backend
 
+# Weitere Dashboard-Prozesse (GREENTHUMB_SHM_ATTACH=1) starten kein eigenes Backend, sondern lesen
+# den Flotten-Zustand, den der Backend-Prozess mit GREENTHUMB_SHM_PUBLISH=1 ins Shared Memory schreibt
+SHARED_MODE = os.environ.get("GREENTHUMB_SHM_ATTACH", "") not in ("", "0")
+
+# Startet MQTT, Scheduler und Zustand nur beim ersten Skriptlauf, Reruns sind wirkungslos
+if not SHARED_MODE:
+    backend.start()
+
 # --- 1. KONFIGURATION & STYLING ---------------------------------------------
 
 st.set_page_config(
@@ -45,13 +52,6 @@ st.markdown("""
 
 # --- 2. LOGIK-HELFER --------------------------------------------------------
 
-def process_backend_data():
-    if hasattr(backend, 'Modules'):
-        for module in backend.Modules.values():
-            while module.MQTT_buffer:
-                msg = module.MQTT_buffer.pop(0)
-                backend.ProcessBufferData(module, msg)
-
 def init_logs():
     for module in backend.Modules.values():
         if not hasattr(module, 'app_log'):
@@ -61,27 +61,14 @@ def init_logs():
 def log_event(module_id, message, type="INFO"):
     module = backend.Modules.get(module_id)
     if module:
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        if not hasattr(module, 'app_log'): module.app_log = []
-        module.app_log.insert(0, {"Zeit": timestamp, "Typ": type, "Nachricht": message})
+        backend.LogEvent(module, message, type)
 
 def get_presets():
-    if not os.path.exists("Presets"): return []
-    return [f.replace("preset_", "").replace(".json", "") for f in os.listdir("Presets") if f.endswith(".json")]
+    return backend.Presets.Names()
 
 def delete_module_safe(mod_id):
-    """Löscht ein Modul und bereinigt vorher alle Scheduler-Jobs."""
-    if mod_id in backend.Modules:
-        mod = backend.Modules[mod_id]
-        # 1. Alle Pflanzen löschen (entfernt Scheduler Jobs)
-        # Wir nutzen list(), um eine Kopie der Keys zu haben, da wir während der Iteration löschen
-        for pot_pos in list(mod.pots.keys()):
-            mod.DeletePot(pot_pos)
-        
-        # 2. Modul aus dem globalen Dictionary entfernen
-        del backend.Modules[mod_id]
-        return True
-    return False
+    """Löscht ein Modul inkl. Scheduler-Jobs und Topic-Route im Backend."""
+    return backend.RemoveModule(mod_id)
 
 # --- UMRECHNUNGSLOGIK ---
 
@@ -146,6 +133,45 @@ def draw_water_tank_graphic(current, min_val, max_val):
     """
     st.markdown(html_code, unsafe_allow_html=True)
 
+def format_hours(hours):
+    if hours is None: return "–"
+    if hours >= 48: return f"{hours / 24:.1f} Tage"
+    return f"{hours:.0f} h"
+
+def draw_water_usage(m_id, mod):
+    # Rollierende Summen kommen fertig aus dem Backend-Ledger, hier wird nichts aufsummiert
+    usage = backend.Ledger.Usage(("module", m_id))
+    c_u1, c_u2, c_u3, c_u4 = st.columns(4)
+    c_u1.metric("💧 Verbrauch 24 h", f"{usage['24h']:.0f} ml")
+    c_u2.metric("💧 Verbrauch 7 Tage", f"{usage['7d']:.0f} ml")
+    c_u3.metric("💧 Verbrauch 30 Tage", f"{usage['30d']:.0f} ml")
+    c_u4.metric("⏳ Tank leer in", format_hours(backend.Ledger.ForecastDepletion(mod)))
+
+def draw_history_charts(m_id, mod):
+    st.markdown("### 📈 Verlauf")
+    rng = st.radio("Zeitraum", list(backend.HISTORY_RANGES), index=1, key="hist_rng", horizontal=True, label_visibility="collapsed")
+    seconds = backend.HISTORY_RANGES[rng]
+
+    # Backend liefert bereits reduzierte (LTTB) und gecachte Kurven, hier werden nur noch ~300 Punkte gezeichnet
+    tank_ts, tank_vals = backend.History.Query(("tank", m_id), seconds)
+    pot_series = {f"{pot.name} (Pos {pos})": backend.History.Query(("moist", m_id, pos), seconds) for pos, pot in mod.pots.items()}
+    pot_series = {name: series for name, series in pot_series.items() if series[0]}
+    if not tank_ts and not pot_series:
+        st.caption("Noch keine Verlaufsdaten.")
+        return
+
+    import pandas as pd
+    def to_series(ts, vals):
+        return pd.Series(vals, index=[datetime.fromtimestamp(t) for t in ts])
+
+    c_tank, c_moist = st.columns(2)
+    with c_tank:
+        st.caption("Wassertank [%]")
+        if tank_ts: st.line_chart(to_series(tank_ts, tank_vals), height=220)
+    with c_moist:
+        st.caption("Bodenfeuchte [%]")
+        if pot_series: st.line_chart(pd.concat({name: to_series(*series) for name, series in pot_series.items()}, axis=1), height=220)
+
 # --- 4. SEITEN --------------------------------------------------------------
 
 def render_sidebar():
@@ -157,7 +183,11 @@ def render_sidebar():
             time.sleep(2)
             st.rerun()
         st.divider()
-        st.info("Systemstatus: Online")
+        status = backend.Overload.Status()
+        if SHARED_MODE or status["level"] == "normal":
+            st.info("Systemstatus: Online")
+        else:
+            st.warning(f"Systemstatus: Überlast ({status['level']}), {status['depth']} Nachrichten wartend")
 
 def page_overview():
     st.title("🌱 Dashboard Übersicht")
@@ -213,6 +243,39 @@ def page_overview():
                         st.toast(f"Modul {m_id} gelöscht!", icon="🗑️")
                         st.rerun()
 
+@st.cache_resource
+def get_shared_reader():
+    return backend.SharedFleetReader()
+
+def page_shared_overview():
+    st.title("🌱 Dashboard Übersicht")
+    try:
+        snap = get_shared_reader().Snapshot()
+    except (FileNotFoundError, ValueError, RuntimeError) as e:
+        st.error(f"Kein Flotten-Zustand im Shared Memory '{backend.SHM_NAME}': {e}")
+        return
+    if snap is None:
+        st.warning("Zustand wird gerade aktualisiert, bitte neu laden.")
+        return
+    age = time.time() - snap["published_at"]
+    st.caption(f"Nur-Lese-Ansicht · Stand vor {age:.0f} s · Version {snap['seq'] // 2}")
+    if not snap["modules"]:
+        st.info("Keine Module vorhanden.")
+        return
+
+    cols = st.columns(2)
+    for idx, (m_id, mod) in enumerate(sorted(snap["modules"].items())):
+        with cols[idx % 2]:
+            with st.container(border=True):
+                st.subheader(f"{mod['name']} (ID: {m_id})")
+                c_a, c_b = st.columns(2)
+                level = mod["tank_lvl"]
+                c_a.metric("💧 Wassertank", f"{level:.0f}%" if level is not None else "?")
+                c_b.metric("🌿 Belegte Plätze", f"{len(mod['pots'])} / 4")
+                for pos, pot in sorted(mod["pots"].items()):
+                    status = "Trocken" if pot["moist"] <= pot["thresh"] else "Feucht"
+                    st.caption(f"{pot['name']} (Pos {pos}): {pot['moist']:.0f}% · Grenzwert {pot['thresh']:.0f}% · {status}")
+
 def page_detail():
     if 'selected_module' not in st.session_state or st.session_state.selected_module not in backend.Modules:
         st.session_state.page = 'overview'
@@ -247,11 +310,15 @@ def page_detail():
     with col_log:
         st.markdown("#### 📝 Logbuch")
         if hasattr(mod, 'app_log') and mod.app_log:
+            import pandas as pd  # nur hier gebraucht, nicht bei jedem Skriptlauf laden
             df = pd.DataFrame(mod.app_log)
             st.dataframe(df, height=200, hide_index=True, use_container_width=True)
         else: st.info("Keine Einträge.")
 
     st.divider()
+    draw_water_usage(m_id, mod)
+    draw_history_charts(m_id, mod)
+    st.divider()
     
     # --- PFLANZEN BEREICH ---
     st.markdown("### 🌿 Pflanzenverwaltung")
@@ -269,6 +336,19 @@ def page_detail():
                         st.rerun()
     
     if not mod.pots: st.caption("Keine Pflanzen konfiguriert.")
+
+    # Preset-Liste einmal pro Rerun statt einmal pro Pflanze
+    preset_options = [""] + get_presets()
+
+    if mod.pots and len(preset_options) > 1:
+        with st.expander("💾 Preset auf alle Pflanzen anwenden"):
+            c_all1, c_all2 = st.columns([2, 1])
+            all_preset = c_all1.selectbox("Preset", preset_options, key="ps_all_sel", label_visibility="collapsed")
+            if c_all2.button("Anwenden", key="ps_all_ld") and all_preset:
+                n = backend.Presets.Apply(all_preset, list(mod.pots.values()))
+                log_event(m_id, f"Preset {all_preset} auf {n} Pflanzen angewendet", "CONFIG")
+                st.toast("Preset angewendet!", icon="💾")
+                st.rerun()
     
     for pos, pot in mod.pots.items():
         with st.container(border=True):
@@ -283,11 +363,18 @@ def page_detail():
                 
                 st.metric(
                     label="Bodenfeuchtigkeit", 
-                    value=f"{moist}%", 
+                    value=f"{moist:.0f}%", 
                     delta=f"Status: {status_moist}",
                     delta_color=delta_color
                 )
                 st.caption(f"Grenzwert: {pot.moist_thresh}%")
+                if pot.control_mode == "adaptive":
+                    rate = pot.dry_rate
+                    next_run = backend.scheduler.NextRun(pot.JobKey())
+                    st.caption(f"Trocknung: {f'{rate:.1f} %/h' if rate is not None else 'wird gelernt'} · "
+                               f"nächster Check: {next_run.strftime('%d.%m. %H:%M') if next_run else '–'}")
+                pot_usage = backend.Ledger.Usage(("pot", m_id, pos))
+                st.caption(f"Verbrauch 24 h / 7 Tage: {pot_usage['24h']:.0f} / {pot_usage['7d']:.0f} ml")
 
             # SPALTE 2: Einstellungen
             with cols[1]:
@@ -295,10 +382,10 @@ def page_detail():
                     # Presets
                     st.caption("Vorlage laden")
                     c_pr1, c_pr2 = st.columns([2,1])
-                    sel_preset = c_pr1.selectbox("Preset", [""] + get_presets(), key=f"ps_sel_{pos}", label_visibility="collapsed")
+                    sel_preset = c_pr1.selectbox("Preset", preset_options, key=f"ps_sel_{pos}", label_visibility="collapsed")
                     if c_pr2.button("Laden", key=f"ps_ld_{pos}") and sel_preset:
                         if pot.LoadPreset(sel_preset):
-                            backend.scheduler.add_job(pot.WaterThePot, 'interval', minutes=pot.wat_event_cyc, id=f"j_M{m_id}P{pos}", replace_existing=True)
+                            pot.Reschedule()
                             st.toast("Preset geladen!", icon="💾")
                             st.rerun()
                     
@@ -341,9 +428,12 @@ def page_detail():
                     
                     st.divider()
                     st.markdown("**Bedingung**")
-                    new_mode = st.radio("Modus", ["time", "moist"], index=0 if pot.control_mode=="time" else 1, key=f"md_{pos}", horizontal=True, format_func=lambda x: "Immer (Zeit)" if x=="time" else "Nur wenn trocken (Sensor)")
+                    mode_labels = {"time": "Immer (Zeit)", "moist": "Nur wenn trocken (Sensor)", "adaptive": "Adaptiv (Vorhersage)"}
+                    new_mode = st.radio("Modus", backend.CONTROL_MODES, index=backend.CONTROL_MODES.index(pot.control_mode), key=f"md_{pos}", horizontal=True, format_func=mode_labels.get)
+                    if new_mode == "adaptive":
+                        st.caption("Intervall = Mindestabstand zwischen zwei Gießvorgängen, geprüft wird zur vorhergesagten Unterschreitung.")
                     
-                    if new_mode == "moist":
+                    if new_mode in backend.SENSOR_MODES:
                         new_thresh = st.slider("Schwellwert (%)", 0, 100, pot.moist_thresh, key=f"th_{pos}")
                     else:
                         new_thresh = pot.moist_thresh
@@ -357,7 +447,7 @@ def page_detail():
                         pot.wat_amount = calc_ml
                         pot.wat_event_cyc = calc_minutes
                         
-                        backend.scheduler.add_job(pot.WaterThePot, 'interval', minutes=pot.wat_event_cyc, id=f"j_M{m_id}P{pos}", replace_existing=True)
+                        pot.Reschedule()
                         log_event(m_id, f"Settings {pot.name}: Alle {new_time_val} {t_unit_sel}, {new_amount_val} {w_unit_sel}", "CONFIG")
                         st.toast("Gespeichert!", icon="✅")
                         st.rerun()
@@ -388,11 +478,16 @@ def page_detail():
 
 # --- 5. MAIN ----------------------------------------------------------------
 
+if SHARED_MODE:
+    render_sidebar()
+    page_shared_overview()
+    st.stop()
+
 if 'page' not in st.session_state:
     st.session_state.page = 'overview'
     init_logs()
 
-process_backend_data()
+# Empfangspuffer arbeitet das Backend selbst im Hintergrund ab (backend.BufferProcessor)
 render_sidebar()
 
 if st.session_state.page == 'overview': page_overview()
@@ -1,31 +1,274 @@
+import time as systime
+_IMPORT_T0 = systime.perf_counter()
+import atexit
+from array import array
+import gzip
 import json
+import math
 import os
-import time as systime
-import paho.mqtt.client as mqtt
-from datetime import datetime, time
+import random
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, time, timezone
 import threading
-from apscheduler.schedulers.background import BackgroundScheduler
+import heapq
+import itertools
+import zlib
+from collections import deque
+
+np = None
+_numpy_checked = False
+
+def _ImportNumpy():
+    # NumPy erst laden, wenn der erste Zustand angelegt wird (Import kostet auf dem Pi spürbar Zeit).
+    # Optional: ohne NumPy laufen die Flotten-Abfragen als Python-Schleifen.
+    global np, _numpy_checked
+    if not _numpy_checked:
+        try:
+            import numpy
+            np = numpy
+        except ImportError:
+            np = None
+        _numpy_checked = True
+    return np
+
+
+# --- Startup-Profiling --------------------------------------------------
+# region
+STARTUP_PROFILE = os.environ.get("GREENTHUMB_PROFILE_STARTUP", "") not in ("", "0")
+
+
+class StartupProfiler:
+    """Misst Import und Initialisierung pro Phase; Ausgabe nur mit GREENTHUMB_PROFILE_STARTUP=1."""
+
+    def __init__(self, enabled=STARTUP_PROFILE):
+        self.enabled = enabled
+        self.phases = []    # (name, Sekunden)
+
+    @contextmanager
+    def Phase(self, name):
+        t0 = systime.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, systime.perf_counter() - t0))
+
+    def Record(self, name, seconds):
+        self.phases.append((name, seconds))
+
+    def Report(self):
+        if not self.enabled:
+            return
+        total = sum(sec for _, sec in self.phases)
+        print("--- Startup-Profil ---------------------------")
+        for name, sec in self.phases:
+            print(f"{name:<32}{sec * 1000:9.1f} ms")
+        print(f"{'gesamt':<32}{total * 1000:9.1f} ms")
+
+
+Profiler = StartupProfiler()
+# endregion
+
+# --- Uhr --------------------------------------------------------------
+# region
+class Clock:
+    """Zeitquelle für Verarbeitung, Scheduler, Alarme und Verbrauch; replay.py setzt eine FakeClock ein."""
+
+    def Time(self):
+        return systime.time()
+
+    def Now(self):
+        return datetime.fromtimestamp(self.Time())
+
+
+class FakeClock(Clock):
+    """Wird nur explizit vorgestellt, läuft also nicht von selbst weiter.
+
+    Now() liefert UTC (ohne tzinfo, gleiches Format wie Clock.Now()), damit Zeitstempel in Befehlen
+    und damit Replay-Digests nicht von der Zeitzone des Rechners abhängen.
+    """
+
+    def __init__(self, t=0.0):
+        self.t = t
+
+    def Time(self):
+        return self.t
+
+    def Now(self):
+        return datetime.fromtimestamp(self.t, timezone.utc).replace(tzinfo=None)
+
+    def Set(self, t):
+        self.t = max(self.t, t)
+
 
+clock = Clock()
+# endregion
+
+# --- Flotten-Zustand (Struct of Arrays) ----------------------------------
+# region
+POTS_PER_MODULE = 4
+TANK_CAPACITY_ML = 10000        # Standard-Tankvolumen, pro Modul über fleet.json ("tank_capacity") änderbar
+CONTROL_MODES = ["time", "moist", "adaptive"]
+SENSOR_MODES = ("moist", "adaptive")     # gießen nur, wenn trocken
+
+
+class FleetState:
+    """Spaltenweiser Zustand aller Module und Pots.
+
+    Pro Feld ein flaches Array; Modul-Felder haben eine Zeile pro Modul, Pot-Felder
+    POTS_PER_MODULE Einträge pro Zeile (Index = Zeile * POTS_PER_MODULE + Position - 1).
+    Module/Pot sind nur Sichten darauf, Flotten-Abfragen laufen in einem Durchgang über die Spalten.
+    """
+
+    MODULE_FIELDS = {"tank_lvl": float("nan"), "tank_raw": float("nan"), "tank_min": 0.0, "tank_max": 100.0}
+    POT_FIELDS = {"active": 0, "mode": 0, "moist": 0.0, "moist_raw": float("nan"), "thresh": 0.0,
+                  "moist_min": 0.0, "moist_max": 100.0,
+                  "interval": 0.0, "last_watered": float("nan"),
+                  # Trocknungsrate (adaptive Intervalle): abklingende Summen der gewichteten Regression,
+                  # Zeitachse in Stunden relativ zum letzten Messwert (sample_t)
+                  "rls_w": 0.0, "rls_t": 0.0, "rls_tt": 0.0, "rls_m": 0.0, "rls_tm": 0.0,
+                  "sample_t": float("nan"), "sample_moist": float("nan")}
+
+    def __init__(self, capacity=16):
+        self._lock = threading.Lock()
+        self.capacity = 0
+        self.initial_capacity = capacity
+        self.rows = {}          # module_id -> Zeile
+        self.free_rows = []
+        self.pot_refs = []      # flacher Pot-Index -> Pot-Objekt
+        self.allocated = False  # Spalten werden erst beim ersten Modul angelegt
+
+    def _Allocate(self):
+        _ImportNumpy()
+        for field, fill in list(self.MODULE_FIELDS.items()) + list(self.POT_FIELDS.items()):
+            setattr(self, field, self._Alloc(0, fill))
+        self._Grow(self.initial_capacity)
+        self.allocated = True
+
+    def _Alloc(self, n, fill):
+        if np is not None:
+            return np.full(n, fill, dtype=np.int8 if isinstance(fill, int) else np.float64)
+        return [fill] * n
+
+    def _Grow(self, capacity):
+        extra = capacity - self.capacity
+        for field, fill in self.MODULE_FIELDS.items():
+            self._Extend(field, self._Alloc(extra, fill))
+        for field, fill in self.POT_FIELDS.items():
+            self._Extend(field, self._Alloc(extra * POTS_PER_MODULE, fill))
+        self.pot_refs.extend([None] * extra * POTS_PER_MODULE)
+        self.free_rows.extend(range(capacity - 1, self.capacity - 1, -1))
+        self.capacity = capacity
+
+    def _Extend(self, field, extra):
+        old = getattr(self, field)
+        setattr(self, field, np.concatenate((old, extra)) if np is not None else old + extra)
+
+    def AddModule(self, module_id):
+        with self._lock:
+            if not self.allocated:
+                self._Allocate()
+            if not self.free_rows:
+                self._Grow(self.capacity * 2)
+            row = self.free_rows.pop()
+            self.rows[module_id] = row
+            for field, fill in self.MODULE_FIELDS.items():
+                getattr(self, field)[row] = fill
+            return row
+
+    def RemoveModule(self, module_id):
+        with self._lock:
+            row = self.rows.pop(module_id, None)
+            if row is not None:
+                for pos in range(1, POTS_PER_MODULE + 1):
+                    self.RemovePot(row, pos)
+                self.free_rows.append(row)
+
+    def AddPot(self, row, module_pos, pot):
+        if not 1 <= module_pos <= POTS_PER_MODULE:
+            raise ValueError(f"module_pos {module_pos} außerhalb 1..{POTS_PER_MODULE}")
+        idx = row * POTS_PER_MODULE + module_pos - 1
+        for field, fill in self.POT_FIELDS.items():
+            getattr(self, field)[idx] = fill
+        self.active[idx] = 1
+        self.pot_refs[idx] = pot
+        return idx
+
+    def RemovePot(self, row, module_pos):
+        idx = row * POTS_PER_MODULE + module_pos - 1
+        self.active[idx] = 0
+        self.pot_refs[idx] = None
+
+    def DryMask(self, idx):
+        """Aktive Sensor-Pots (moist/adaptive) mit Feuchte <= Schwellwert, für die flachen Pot-Indizes idx."""
+        if not self.allocated:
+            return [False] * len(idx)
+        codes = [CONTROL_MODES.index(m) for m in SENSOR_MODES]
+        if np is not None:
+            idx = np.asarray(idx, dtype=np.intp)
+            return (self.active[idx] == 1) & np.isin(self.mode[idx], codes) & (self.moist[idx] <= self.thresh[idx])
+        return [self.active[i] == 1 and self.mode[i] in codes and self.moist[i] <= self.thresh[i] for i in idx]
+
+
+class _Column:
+    """Attribut, das in einer FleetState-Spalte liegt (obj._row bei Modulen, obj._idx bei Pots)."""
+
+    def __init__(self, field, index_attr, decode=float, encode=float):
+        self.field = field
+        self.index_attr = index_attr
+        self.decode = decode
+        self.encode = encode
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        return self.decode(getattr(Fleet, self.field)[getattr(obj, self.index_attr)])
+
+    def __set__(self, obj, value):
+        getattr(Fleet, self.field)[getattr(obj, self.index_attr)] = self.encode(value)
+
+
+def _NanToNone(v):
+    return None if v != v else float(v)
+
+def _NoneToNan(v):
+    return float("nan") if v is None else float(v)
+
+def _TimestampToDatetime(v):
+    return None if v != v else datetime.fromtimestamp(float(v))
+
+def _DatetimeToTimestamp(v):
+    return float("nan") if v is None else v.timestamp()
+
+
+Fleet = FleetState()
+# endregion
 
 # --- Klassen Komposition -------------------------------------------------
 
 class Module:
+    __slots__ = ("module_id", "name", "wat_event_time", "MQTT_buffer", "pots", "app_log", "TankCapacity", "_row")
+
+    TankLvl = _Column("tank_lvl", "_row", _NanToNone, _NoneToNan)
+    TankLvlMax = _Column("tank_max", "_row")
+    TankLvlMin = _Column("tank_min", "_row")
+    TankLvlRaw = _Column("tank_raw", "_row", _NanToNone, _NoneToNan)
+
     def __init__(self, module_id, name):
         self.module_id = module_id
         self.name = name
         self.wat_event_time = time(9,0)
-        # ÄNDERUNG 1: Variablen initialisiert (vorher Syntaxfehler)
-        self.TankLvl = None
-        self.TankLvlMax = 100
-        self.TankLvlMin = 0
-        self.MQTT_buffer = []
+        self._row = Fleet.AddModule(module_id)
+        self.MQTT_buffer = deque(maxlen=MQTT_MODULE_BUFFER_MAX)
         self.pots = {}
+        self.TankCapacity = TANK_CAPACITY_ML
         # ÄNDERUNG 2: Log-Liste für Streamlit hinzugefügt
         self.app_log = [] 
 
     # --- Create Pots, module function -----------------------
     # region 
-    def AddPot(self, module_pos, name, control_mode, water_amount, wat_event_cyc, moist_thresh):
+    def AddPot(self, module_pos, name, control_mode, water_amount, wat_event_cyc, moist_thresh, schedule=True, verbose=True):
         # ÄNDERUNG 3: Explizite Umwandlung in Zahlen (float/int), damit Streamlit nicht abstürzt
         pot = Pot(
             module = self,
@@ -37,31 +280,26 @@ class Module:
             moist_thresh=int(moist_thresh)
         )
         self.pots[pot.module_pos] = pot
-        print(f"Pot {pot.name} added to Module {self.module_id} at position {pot.module_pos}.")
-
-        # Job-ID prüfen, um Fehler bei Neuladen zu vermeiden
-        job_id = f"j_M{self.module_id}P{pot.module_pos}"
-        if scheduler.get_job(job_id):
-            scheduler.remove_job(job_id)
-
-        scheduler.add_job(
-            pot.WaterThePot,
-            'interval',
-            minutes = pot.wat_event_cyc,
-            id = job_id,
-            replace_existing = True,
-            misfire_grace_time = 1800)  
-        print(f"Scheduler-Job erstellt für Pot {pot.module_pos} (Intervall: {pot.wat_event_cyc} min)")
+        pot.moist_min, pot.moist_max = Calibration.Bounds(self.module_id, pot.module_pos)
+        if verbose:
+            print(f"Pot {pot.name} added to Module {self.module_id} at position {pot.module_pos}.")
+
+        # schedule=False: Aufrufer plant gesammelt (ApplyFleetConfig -> scheduler.ScheduleMany)
+        if schedule:
+            pot.Reschedule()
+            if verbose:
+                print(f"Scheduler-Job erstellt für Pot {pot.module_pos} (Intervall: {pot.wat_event_cyc} min)")
 
         return pot
     # endregion
 
     # region 
     def DeletePot(self,module_pos):
-        # Job-Existenz prüfen vor dem Löschen
-        job_id = f"j_M{self.module_id}P{module_pos}"
-        if scheduler.get_job(job_id):
-            scheduler.remove_job(job_id)
+        scheduler.Cancel(f"j_M{self.module_id}P{module_pos}")
+        Fleet.RemovePot(self._row, module_pos)
+        History.Drop(self.module_id, module_pos)
+        Alerts.Forget(self.module_id, module_pos)
+        Ledger.Forget(self.module_id, module_pos)
             
         if module_pos in self.pots:
             del self.pots[module_pos]
@@ -71,19 +309,33 @@ class Module:
 
 
 class Pot:
+    __slots__ = ("module", "module_pos", "name", "wat_amount", "_idx")
+
+    control_mode = _Column("mode", "_idx", CONTROL_MODES.__getitem__, CONTROL_MODES.index)
+    moist_value = _Column("moist", "_idx")
+    moist_thresh = _Column("thresh", "_idx", int, int)
+    moist_min = _Column("moist_min", "_idx")
+    moist_max = _Column("moist_max", "_idx")
+    moist_raw = _Column("moist_raw", "_idx", _NanToNone, _NoneToNan)
+    wat_event_cyc = _Column("interval", "_idx", lambda v: float(v) / 60, lambda v: float(v) * 60)
+    last_wat_event = _Column("last_watered", "_idx", _TimestampToDatetime, _DatetimeToTimestamp)
+    rls_w = _Column("rls_w", "_idx")
+    rls_t = _Column("rls_t", "_idx")
+    rls_tt = _Column("rls_tt", "_idx")
+    rls_m = _Column("rls_m", "_idx")
+    rls_tm = _Column("rls_tm", "_idx")
+    sample_t = _Column("sample_t", "_idx", _NanToNone, _NoneToNan)
+    sample_moist = _Column("sample_moist", "_idx", _NanToNone, _NoneToNan)
+
     def __init__(self, module, module_pos, name, control_mode, wat_amount, wat_event_cyc, moist_thresh):
         self.module=module
         self.module_pos = module_pos
+        self._idx = Fleet.AddPot(module._row, module_pos, self)
         self.control_mode = control_mode
         self.name = name
         self.wat_amount = wat_amount
         self.wat_event_cyc = wat_event_cyc
         self.moist_thresh = moist_thresh
-        self.last_wat_event = None
-        self.moist_value = 0
-        # ÄNDERUNG 1: Variablen initialisiert
-        self.moist_max = 100
-        self.moist_min = 0
     """
     def CheckMoisture(self):
         cur_cmd_timestamp = datetime.now().isoformat()
@@ -124,98 +376,458 @@ class Pot:
         trigger = False
         if self.control_mode == "time":
             trigger = True
-        elif self.control_mode == "moist" and self.moist_value <= self.moist_thresh:
+        elif self.control_mode in SENSOR_MODES and self.moist_value <= self.moist_thresh:
             trigger = True
             
         if trigger:
-            cur_cmd_timestamp = datetime.now()
-            payload = json.dumps({"Type": "RequestWatering", "time_stamp": cur_cmd_timestamp.isoformat(), "Pot": self.module_pos, "Amount": self.wat_amount})
-            topic = f"{MQTT_SuperTOPIC}/Module{self.module.module_id}/cmd"
-            result = client.publish(topic, payload, qos=1)
-
-            status = result[0]
-            if status == 0:
-                print(f"[{datetime.now().isoformat()}] MQTT → {payload}")
-            else:
-                print(f"Fehler beim Senden an MQTT: {status}")
-                
-        elif self.control_mode == "moist" and self.moist_value > self.moist_thresh:
+            self.SendWatering()
+        elif self.control_mode in SENSOR_MODES and self.moist_value > self.moist_thresh:
             print(f"Pot {self.module_pos} not watered due to moisture value")
         else: print(f"wtf happened here!?")
 
-    def SavePreset(self, preset_name):
-        os.makedirs("Presets", exist_ok=True)
+    def SendWatering(self):
+        cur_cmd_timestamp = clock.Now()
+        payload = json.dumps({"Type": "RequestWatering", "time_stamp": cur_cmd_timestamp.isoformat(), "Pot": self.module_pos, "Amount": self.wat_amount})
+        topic = f"{MQTT_SuperTOPIC}/Module{self.module.module_id}/cmd"
+        # Abgelehnt (Queue voll, Backend nicht gestartet): den Zeitpunkt nicht setzen, sonst verschiebt
+        # der adaptive Modus den nächsten Check. Verbucht wird erst beim Senden (OnCommandPublished).
+        if not SubmitCommand(self.module.module_id, topic, payload):
+            return False
+        self.last_wat_event = cur_cmd_timestamp
+        return True
+
+    def JobKey(self):
+        return f"j_M{self.module.module_id}P{self.module_pos}"
+
+    def DryingFit(self):
+        """(Trocknung in %/h, geglättete Feuchte beim letzten Messwert) aus der Regression; None bei zu wenig Messzeit."""
+        w, st, stt, sm, stm = self.rls_w, self.rls_t, self.rls_tt, self.rls_m, self.rls_tm
+        if w <= 0:
+            return None
+        var = stt / w - (st / w) ** 2
+        if var < (ADAPTIVE_MIN_SPAN / 3600) ** 2 / 12:     # entspricht gleichmäßig verteilten Werten über MIN_SPAN
+            return None
+        slope = (w * stm - st * sm) / (w * stt - st * st)
+        return -slope, (sm - slope * st) / w
+
+    @property
+    def dry_rate(self):
+        """Geschätzte Trocknung in %/h, None solange zu wenig Messzeit vorliegt."""
+        fit = self.DryingFit()
+        return fit[0] if fit else None
+
+    def UpdateDryingRate(self, now):
+        # Exponentiell gewichtete lineare Regression (RLS mit Vergessensfaktor): O(1) pro Messwert,
+        # die Summen werden auf den neuen Messwert als Nullpunkt verschoben und abgeklungen.
+        # Ein Anstieg (Gießen) startet die Regression neu.
+        moist = self.moist_value
+        t_prev, m_prev = self.sample_t, self.sample_moist
+        self.sample_t, self.sample_moist = now, moist
+        if t_prev is None or now <= t_prev or moist - m_prev >= ADAPTIVE_JUMP:
+            self.rls_w, self.rls_t, self.rls_tt, self.rls_m, self.rls_tm = 1.0, 0.0, 0.0, moist, 0.0
+            return
+        d = (now - t_prev) / 3600
+        decay = math.exp(-(now - t_prev) / ADAPTIVE_TAU)
+        w, st, stt, sm, stm = self.rls_w, self.rls_t, self.rls_tt, self.rls_m, self.rls_tm
+        self.rls_tt = (stt - 2 * d * st + d * d * w) * decay
+        self.rls_tm = (stm - d * sm) * decay
+        self.rls_t = (st - d * w) * decay
+        self.rls_w = w * decay + 1.0
+        self.rls_m = sm * decay + moist
 
-        data = {
+    def AdaptiveDue(self, now):
+        """Nächster Check zur vorhergesagten Schwellwert-Unterschreitung (höchstens ADAPTIVE_MAX_CHECK entfernt).
+
+        wat_event_cyc ist hier der Mindestabstand zwischen zwei Gießvorgängen; ohne Rate wird in diesem Takt geprüft.
+        """
+        interval = self.wat_event_cyc * 60
+        fit = self.DryingFit()
+        if self.moist_value <= self.moist_thresh:
+            delay = ADAPTIVE_MIN_CHECK
+        elif fit is None or fit[0] <= 0:
+            delay = interval
+        else:
+            rate, level = fit
+            delay = min(max((level - self.moist_thresh) / rate * 3600, ADAPTIVE_MIN_CHECK), ADAPTIVE_MAX_CHECK)
+        due = now + delay
+        last = Fleet.last_watered[self._idx]
+        if last == last:
+            due = max(due, last + interval)
+        return due
+
+    def AdaptiveReschedule(self, now):
+        # Nur nennenswerte Verschiebungen planen neu (jede legt einen Heap-Eintrag an), relativ zur
+        # Restzeit, damit Rauschen in der Rate nicht bei jedem Messwert umplant
+        due = self.AdaptiveDue(now)
+        current = scheduler.DueAt(self.JobKey())
+        if current is not None:
+            hysteresis = max(ADAPTIVE_RESCHEDULE_MIN, ADAPTIVE_RESCHEDULE_FRAC * (min(due, current) - now))
+            if abs(current - due) < hysteresis:
+                return False
+            # Nie nach hinten bei trockenem Pot; an der Obergrenze erst, wenn die Hälfte davon verstrichen ist
+            if due > current and (self.moist_value <= self.moist_thresh
+                                  or (due - now >= ADAPTIVE_MAX_CHECK and current - now >= ADAPTIVE_MAX_CHECK / 2)):
+                return False
+        scheduler.Schedule(self.JobKey(), self, self.wat_event_cyc * 60, WaterPots, delay=max(due - now, 0))
+        MetricInc("adaptive.rescheduled")
+        return True
+
+    def Reschedule(self):
+        # Legt den Gieß-Termin an oder verschiebt ihn nach einer Änderung von wat_event_cyc
+        return scheduler.Schedule(self.JobKey(), self, self.wat_event_cyc * 60, WaterPots)
+
+    def PresetData(self):
+        return {
             "control_mode": self.control_mode,
             "wat_amount": self.wat_amount,
             "wat_event_cyc": self.wat_event_cyc,
             "moist_thresh": self.moist_thresh
         }
 
-        filename = f"Presets/preset_{preset_name}.json"
-        with open(filename, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=4)
+    def ApplyPresetData(self, data):
+        # Werte ins Objekt laden
+        self.control_mode  = data.get("control_mode",  self.control_mode)
+        self.wat_amount    = data.get("wat_amount",    self.wat_amount)
+        self.wat_event_cyc = data.get("wat_event_cyc", self.wat_event_cyc)
+        self.moist_thresh  = data.get("moist_thresh",  self.moist_thresh)
 
-        print(f"Preset saved: {filename}")
+    def SavePreset(self, preset_name):
+        Presets.Save(preset_name, self.PresetData())
 
     def LoadPreset(self, preset_name):
-        filename = f"Presets/preset_{preset_name}.json"
-
-        # Prüfen ob Datei existiert
-        if not os.path.isfile(filename):
-            print(f"Preset not found: {filename}")
+        data = Presets.Get(preset_name)
+        if data is None:
             return False
+        self.ApplyPresetData(data)
+        print(f"Preset loaded: {preset_name}")
+        return True
 
-        try:
-            with open(filename, "r", encoding="utf-8") as f:
-                data = json.load(f)
 
-            # Werte ins Objekt laden
-            self.control_mode  = data.get("control_mode",  self.control_mode)
-            self.wat_amount    = data.get("wat_amount",    self.wat_amount)
-            self.wat_event_cyc = data.get("wat_event_cyc", self.wat_event_cyc)
-            self.moist_thresh  = data.get("moist_thresh",  self.moist_thresh)
+# --- Presets ----------------------------------------------------------
+# region
+PRESET_DIR = "Presets"
 
-            print(f"Preset loaded: {filename}")
-            return True
-        
+class PresetRepository:
+    """Preset-Dateien mit In-Memory-Index; neu eingelesen wird nur, was sich laut mtime geändert hat."""
+
+    def __init__(self, directory=PRESET_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._dir_mtime = None
+        self._index = {}    # name -> [datei_mtime, daten oder None (noch nicht gelesen)]
+
+    def _Filename(self, name):
+        return os.path.join(self.directory, f"preset_{name}.json")
+
+    def _RefreshIndex(self):
+        # Ein stat() auf den Ordner pro Aufruf; listdir nur bei Anlegen/Löschen/Umbenennen
+        try:
+            dir_mtime = os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            self._dir_mtime, self._index = None, {}
+            return
+        if dir_mtime == self._dir_mtime:
+            return
+        index = {}
+        for f in os.listdir(self.directory):
+            if f.startswith("preset_") and f.endswith(".json"):
+                name = f[len("preset_"):-len(".json")]
+                index[name] = self._index.get(name, [None, None])
+        self._dir_mtime, self._index = dir_mtime, index
+
+    def _Load(self, name):
+        entry = self._index.get(name)
+        if entry is None:
+            return None
+        filename = self._Filename(name)
+        try:
+            mtime = os.stat(filename).st_mtime_ns
+            if entry[0] != mtime or entry[1] is None:
+                with open(filename, "r", encoding="utf-8") as f:
+                    entry[1] = json.load(f)
+                entry[0] = mtime
+            return entry[1]
         except Exception as e:
-            print(f"Error loading preset '{preset_name}': {e}")
-            return False
-        
+            print(f"Error loading preset '{name}': {e}")
+            return None
+
+    def Names(self):
+        with self._lock:
+            self._RefreshIndex()
+            return sorted(self._index)
+
+    def Get(self, name):
+        return self.GetMany([name]).get(name)
+
+    def GetMany(self, names):
+        with self._lock:
+            self._RefreshIndex()
+            result = {}
+            for name in names:
+                data = self._Load(name)
+                if data is None:
+                    print(f"Preset not found: {self._Filename(name)}")
+                else:
+                    result[name] = dict(data)
+            return result
+
+    def Save(self, name, data):
+        self.SaveMany({name: data})
+
+    def SaveMany(self, presets):
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            for name, data in presets.items():
+                filename = self._Filename(name)
+                # Atomar über Temp-Datei, damit parallele Leser nie eine halbe Datei sehen
+                tmp = filename + ".tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(data, f, indent=4)
+                os.replace(tmp, filename)
+                self._index[name] = [os.stat(filename).st_mtime_ns, dict(data)]
+                print(f"Preset saved: {filename}")
+
+    def Apply(self, name, pots):
+        """Wendet ein Preset auf mehrere Pots an und plant deren Jobs neu; gibt die Anzahl zurück."""
+        data = self.Get(name)
+        if data is None:
+            return 0
+        count = 0
+        for pot in pots:
+            pot.ApplyPresetData(data)
+            pot.Reschedule()
+            count += 1
+        print(f"Preset {name} applied to {count} pots")
+        return count
+
+
+Presets = PresetRepository()
+# endregion
+
+# --- Kalibrierung -----------------------------------------------------
+# region
+CALIBRATION_FILE = "calibration.json"
+CALIB_LUT_MAX_SIZE = 1 << 12    # Einträge (float32, 12-Bit-ADC passt); größere Bereiche ohne Tabelle
+TANK_SENSOR_POS = 0             # Position 0 = Füllstandssensor (wie in ReqestCalibration)
+
+
+class CalibrationTable:
+    """Rohwert -> Prozent (0..100), stückweise linear über Stützpunkte (raw, pct).
+
+    Zwei Stützpunkte (min/max, der Normalfall) sind eine Gerade: Steigung und Achsenabschnitt,
+    keine Tabelle. Nur Mehrpunkt-Kurven werden für ganzzahlige Rohwerte einmal als float32-Tabelle
+    vorberechnet. Die Richtung ist egal (kapazitive Sensoren: trocken > nass).
+    """
+
+    def __init__(self, points):
+        _ImportNumpy()
+        self.points = sorted((float(r), float(p)) for r, p in points)
+        if len(self.points) < 2 or self.points[0][0] == self.points[-1][0]:
+            raise ValueError(f"Kalibrierung braucht zwei verschiedene Rohwerte: {points}")
+        self.lo = int(self.points[0][0])
+        self.hi = int(self.points[-1][0])
+        self.lut = None
+        self.linear = None      # (Steigung, Achsenabschnitt) bei zwei Stützpunkten
+        if len(self.points) == 2:
+            (x0, y0), (x1, y1) = self.points
+            slope = (y1 - y0) / (x1 - x0)
+            self.linear = (slope, y0 - slope * x0)
+        elif self.hi - self.lo + 1 <= CALIB_LUT_MAX_SIZE:
+            raws = range(self.lo, self.hi + 1)
+            if np is not None:
+                xs, ys = zip(*self.points)
+                self.lut = np.clip(np.interp(np.arange(self.lo, self.hi + 1), xs, ys), 0, 100).astype(np.float32)
+            else:
+                self.lut = array("f", (self._Interp(r) for r in raws))
+
+    @classmethod
+    def FromBounds(cls, raw_min, raw_max):
+        # min = leer/trocken = 0 %, max = voll/nass = 100 %
+        return cls([(raw_min, 0.0), (raw_max, 100.0)])
+
+    def _Interp(self, raw):
+        pts = self.points
+        if raw <= pts[0][0]:
+            return min(100.0, max(0.0, pts[0][1]))
+        for (x0, y0), (x1, y1) in zip(pts, pts[1:]):
+            if raw <= x1:
+                return min(100.0, max(0.0, y0 + (y1 - y0) * (raw - x0) / (x1 - x0)))
+        return min(100.0, max(0.0, pts[-1][1]))
+
+    def Apply(self, raw):
+        if self.linear is not None:
+            slope, offset = self.linear
+            return min(100.0, max(0.0, slope * raw + offset))
+        if self.lut is None or raw != int(raw):
+            return self._Interp(raw)
+        i = int(raw) - self.lo
+        if i < 0:
+            i = 0
+        elif i > self.hi - self.lo:
+            i = self.hi - self.lo
+        return float(self.lut[i])
+
+    def ApplyMany(self, raws):
+        """Vektorisierte Variante für Batches (Replay, Historie)."""
+        if np is not None and self.linear is not None:
+            slope, offset = self.linear
+            return np.clip(np.asarray(raws, dtype=np.float64) * slope + offset, 0, 100)
+        if np is not None and self.lut is not None:
+            idx = np.clip(np.asarray(raws, dtype=np.int64) - self.lo, 0, self.hi - self.lo)
+            return self.lut[idx]
+        return [self.Apply(r) for r in raws]
+
+
+class CalibrationStore:
+    """Kalibrierdaten pro Sensor (module_id, pos), persistent in CALIBRATION_FILE."""
+
+    def __init__(self, filename=CALIBRATION_FILE):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self.data = {}      # (module_id, pos) -> {"min": .., "max": .., "points": [...] optional}
+        self.tables = {}    # (module_id, pos) -> CalibrationTable
+        self._default = None
+
+    def Load(self):
+        filename = self.filename
+        if os.path.isfile(filename):
+            try:
+                with open(filename, "r", encoding="utf-8") as f:
+                    for key, entry in json.load(f).items():
+                        module_id, pos = key.split("/")
+                        self.data[(int(module_id), int(pos))] = entry
+                for key in self.data:
+                    self._Rebuild(key)
+            except Exception as e:
+                print(f"Error loading calibration '{filename}': {e}")
+
+    def _Rebuild(self, key):
+        entry = self.data.get(key, {})
+        try:
+            if entry.get("points"):
+                self.tables[key] = CalibrationTable(entry["points"])
+            else:
+                self.tables[key] = CalibrationTable.FromBounds(entry.get("min", 0), entry.get("max", 100))
+        except ValueError as e:
+            print(f"Kalibrierung {key} ungültig: {e}")
+            self.tables.pop(key, None)
+
+    def _Save(self):
+        tmp = self.filename + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({f"{m}/{p}": entry for (m, p), entry in self.data.items()}, f, indent=4)
+        os.replace(tmp, self.filename)
+
+    def Table(self, module_id, pos):
+        table = self.tables.get((module_id, pos))
+        if table is None:
+            if self._default is None:
+                self._default = CalibrationTable.FromBounds(0, 100)
+            table = self._default
+        return table
+
+    def Bounds(self, module_id, pos):
+        entry = self.data.get((module_id, pos), {})
+        return entry.get("min", 0), entry.get("max", 100)
+
+    def Set(self, module_id, pos, minORmax, value):
+        with self._lock:
+            key = (module_id, pos)
+            entry = self.data.setdefault(key, {})
+            entry[minORmax] = value
+            entry.pop("points", None)
+            self._Rebuild(key)
+            self._Save()
+
+    def Update(self, entries):
+        """Bulk-Variante: {(module_id, pos): {"min", "max" | "points"}}; nur geänderte Tabellen, ein Speichervorgang."""
+        changed = 0
+        with self._lock:
+            for key, entry in entries.items():
+                if self.data.get(key) == entry:
+                    continue
+                self.data[key] = dict(entry)
+                self._Rebuild(key)
+                changed += 1
+            if changed:
+                self._Save()
+        return changed
+
+    def SetPoints(self, module_id, pos, points):
+        """Mehrpunkt-Kalibrierung [(raw, pct), ...] für nichtlineare Sensoren."""
+        with self._lock:
+            key = (module_id, pos)
+            self.data.setdefault(key, {})["points"] = [list(p) for p in points]
+            self._Rebuild(key)
+            self._Save()
+
+
+Calibration = CalibrationStore()
+# endregion
+
 
 # --- MQTT Setup -----------------------------------------------------
 # region MQTT Setup 
+MQTT_ERR_SUCCESS = 0            # = paho.mqtt.client.MQTT_ERR_SUCCESS, paho wird erst in start() importiert
+MQTT_ERR_NO_CONN = 4            # = paho.mqtt.client.MQTT_ERR_NO_CONN
 MQTT_BROKER = "mqtt.croku.at"
 MQTT_PORT = 1883
+# Mehrere Verbindungen/Broker als "host:port,host:port" (gleiche Adresse mehrfach = mehrere Sockets)
+MQTT_BROKERS = [(h.partition(":")[0], int(h.partition(":")[2] or MQTT_PORT))
+                for h in os.environ.get("GREENTHUMB_MQTT_BROKERS", f"{MQTT_BROKER}:{MQTT_PORT}").split(",") if h.strip()]
 MQTT_SuperTOPIC = "Greenthumb"
-MQTT_data_buffer = []
+# Empfangspuffer pro Modul: leert der BufferProcessor; staut es sich trotzdem, fallen die ältesten Nachrichten raus
+MQTT_MODULE_BUFFER_MAX = 1000
+
+
+# Alle Modul-Antworten laufen über ein einziges Wildcard-Abo statt einem SUBSCRIBE pro AddModule
+MQTT_WILDCARD_SUB = True
+MQTT_RESP_WILDCARD = f"{MQTT_SuperTOPIC}/+/resp"
 
+# Routing-Tabelle: Topic -> (Handler, Modul), wird von AddModule/RemoveModule gepflegt
+TopicRoutes = {}
 
-client = mqtt.Client()
+def RespTopic(module_id):
+    return f"{MQTT_SuperTOPIC}/Module{module_id}/resp"
 
-def on_connect(c, u, flags, rc): print("MQTT connected:", rc)
-def on_disconnect(c, u, rc):      print("MQTT disconnected:", rc)
+
+# userdata der Callbacks ist jeweils der MQTTShard der Verbindung
+def on_connect(c, u, flags, rc):
+    print(f"MQTT connected ({u.name}):", rc)
+    if rc == 0:
+        u.OnConnected()
+
+def on_disconnect(c, u, rc):
+    print(f"MQTT disconnected ({u.name}):", rc)
+    u.OnDisconnected()
+
+def BufferModuleMessage(module, data):
+    if Overload.level > OVERLOAD_NORMAL and data.get("Type") == "CycSensorValues":
+        Overload.Coalesce(module, data)
+        return
+    if len(module.MQTT_buffer) == module.MQTT_buffer.maxlen:
+        MetricInc("mqtt.buffer_dropped")    # ältester Eintrag fällt raus, Queue-Tiefe bleibt gleich
+    else:
+        Overload.OnEnqueued()
+    module.MQTT_buffer.append((clock.Time(), data))
+    if buffer_processor is not None:
+        buffer_processor.Wake()
+    if Overload.level == OVERLOAD_NORMAL:
+        print(f"Antwort empfangen: {data}")
 
 def on_message(client, userdata, msg):
+    if Capture is not None:
+        Capture.Record("in", msg.topic, msg.payload)
+    # Direkter Lookup statt split/replace/isdigit pro Nachricht; unbekannte Module werden ignoriert
+    route = TopicRoutes.get(msg.topic)
+    if route is None:
+        return
+    handler, module = route
+    if Overload.level == OVERLOAD_SAMPLE and Overload.SampleDrop(module, msg.payload):
+        return
     try:
-        data = json.loads(msg.payload.decode())    
-        
-        # ÄNDERUNG 4: Korrektur Tippfehler und Parsing-Logik
-        # Original war: msg.topic.replac("Greenthumb/Modul", "") -> Tippfehler 'replac' und Logikfehler 'Modul' vs 'Module'
-        parts = msg.topic.split('/')
-        if len(parts) >= 2 and "Module" in parts[1]:
-            mod_id_str = parts[1].replace("Module", "")
-            if mod_id_str.isdigit():
-                mod_id = int(mod_id_str)
-                module = Modules.get(mod_id)
-                if module:
-                    MQTT_data_buffer.append(data)
-                    # ÄNDERUNG 5: Tippfehler abbend -> append
-                    module.MQTT_buffer.append(data)
-                    print(f"Antwort empfangen: {data}")
-
+        data = json.loads(msg.payload.decode())
+        handler(module, data)
     except Exception as e:
         print(f"Fehler beim Verarbeiten der MQTT-Nachricht: {e}")
 '''
@@ -227,33 +839,1144 @@ rc	Bedeutung	Erklärung
 4	Falscher Benutzername oder Passwort	Authentifizierungsfehler
 5	Nicht autorisiert	Keine Berechtigung für die Verbindung
 '''
-client.on_connect = on_connect
-client.on_disconnect = on_disconnect
-client.on_message = on_message
-
-try:
-    client.connect(MQTT_BROKER, MQTT_PORT, 60)
-    client.loop_start()
-except Exception as e:
-    print(f"MQTT Connection failed: {e}")
+# endregion
+
+# --- Überlast / Load-Shedding -----------------------------------------
+# region
+# Stufen: normal -> coalesce (pro Modul nur die neueste Sensor-Messung) -> sample (zusätzlich höchstens
+# eine Messung pro Modul und Intervall, verworfen noch vor dem JSON-Decode). Quittungen und
+# Kalibrier-Antworten werden nie verworfen.
+OVERLOAD_LEVELS = ("normal", "coalesce", "sample")
+OVERLOAD_NORMAL, OVERLOAD_COALESCE, OVERLOAD_SAMPLE = range(3)
+OVERLOAD_COALESCE_DEPTH = 200   # wartende Nachrichten über alle Module
+OVERLOAD_SAMPLE_DEPTH = 1000
+OVERLOAD_COALESCE_LAG = 2.0     # Sekunden vom Empfang bis zur Verarbeitung
+OVERLOAD_SAMPLE_LAG = 10.0
+OVERLOAD_EXIT_FACTOR = 0.5      # zurückgeschaltet wird erst unter der halben Schwelle ...
+OVERLOAD_RECOVER = 30.0         # ... und wenn das so lange anhält (Sekunden)
+OVERLOAD_SAMPLE_INTERVAL = 60.0 # Sample-Stufe: Sekunden zwischen zwei angenommenen Messungen pro Modul
+SENSOR_MSG_MARKER = b'"CycSensorValues"'
+
+
+class OverloadController:
+    """Beobachtet Queue-Tiefe und Verarbeitungs-Lag der Empfangspuffer und schaltet die Shedding-Stufen."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.level = OVERLOAD_NORMAL
+        self.depth = 0              # wartende Nachrichten (Puffer + zusammengefasste Messungen)
+        self.lag = 0.0              # größter Lag der letzten Verarbeitungsrunde
+        self.coalesced = {}         # module -> (t_erste, t_letzte, data)
+        self.sampled_at = {}        # module_id -> Zeitpunkt der letzten angenommenen Messung
+        self.since = None           # Beginn der aktuellen Stufe
+        self._calm_since = None
+        self._episode = None        # Zähler seit Eintritt in den Shedding-Modus
+
+    def _Target(self, scale):
+        if self.depth >= OVERLOAD_SAMPLE_DEPTH * scale or self.lag >= OVERLOAD_SAMPLE_LAG * scale:
+            return OVERLOAD_SAMPLE
+        if self.depth >= OVERLOAD_COALESCE_DEPTH * scale or self.lag >= OVERLOAD_COALESCE_LAG * scale:
+            return OVERLOAD_COALESCE
+        return OVERLOAD_NORMAL
+
+    def _Evaluate(self, now):
+        # Hoch sofort, herunter nur stufenweise nach OVERLOAD_RECOVER Sekunden unter der Austrittsschwelle
+        target = self._Target(1.0)
+        if target > self.level:
+            self._calm_since = None
+            self._Switch(target, now)
+        elif self.level > OVERLOAD_NORMAL and self._Target(OVERLOAD_EXIT_FACTOR) < self.level:
+            if self._calm_since is None:
+                self._calm_since = now
+            elif now - self._calm_since >= OVERLOAD_RECOVER:
+                self._calm_since = now
+                self._Switch(self.level - 1, now)
+        else:
+            self._calm_since = None
+
+    def _Switch(self, level, now):
+        old, self.level, self.since = self.level, level, now
+        MetricSet("overload.level", level)
+        stamp = clock.Now().isoformat()
+        if old == OVERLOAD_NORMAL:
+            MetricInc("overload.episodes")
+            self._episode = {"start": now, "coalesced": Metrics.get("overload.coalesced", 0),
+                             "sampled_out": Metrics.get("overload.sampled_out", 0)}
+        print(f"[{stamp}] Überlast: {OVERLOAD_LEVELS[old]} -> {OVERLOAD_LEVELS[level]} "
+              f"(Queue {self.depth}, Lag {self.lag:.1f}s)")
+        if level == OVERLOAD_NORMAL and self._episode is not None:
+            ep = self._episode
+            print(f"[{stamp}] Überlast beendet nach {now - ep['start']:.0f}s: "
+                  f"{Metrics.get('overload.coalesced', 0) - ep['coalesced']} Messungen zusammengefasst, "
+                  f"{Metrics.get('overload.sampled_out', 0) - ep['sampled_out']} verworfen")
+            self._episode = None
+            self.sampled_at.clear()
+
+    def SampleDrop(self, module, payload):
+        """Sample-Stufe: True, wenn die Sensor-Nachricht ungelesen verworfen werden soll (spart den JSON-Decode)."""
+        if SENSOR_MSG_MARKER not in payload:
+            return False
+        now = clock.Time()
+        with self._lock:
+            last = self.sampled_at.get(module.module_id)
+            if last is not None and now - last < OVERLOAD_SAMPLE_INTERVAL:
+                drop = True
+            else:
+                self.sampled_at[module.module_id] = now
+                drop = False
+        if drop:
+            MetricInc("overload.sampled_out")
+        return drop
+
+    def OnEnqueued(self):
+        now = clock.Time()
+        with self._lock:
+            self.depth += 1
+            self._Evaluate(now)
+
+    def Coalesce(self, module, data):
+        # Nur die neueste Messung pro Modul bleibt liegen; t_erste bleibt für die Lag-Messung erhalten
+        now = clock.Time()
+        with self._lock:
+            prev = self.coalesced.get(module)
+            if prev is None:
+                self.depth += 1
+            self.coalesced[module] = (prev[0] if prev else now, now, data)
+            self._Evaluate(now)
+        if prev is not None:
+            MetricInc("overload.coalesced")
+
+    def TakeCoalesced(self):
+        with self._lock:
+            items, self.coalesced = self.coalesced, {}
+        return items
+
+    def OnProcessed(self, count, lag):
+        now = clock.Time()
+        with self._lock:
+            self.depth = max(0, self.depth - count)
+            self.lag = lag
+            self._Evaluate(now)
+        MetricSet("overload.depth", self.depth)
+        MetricSet("overload.lag", round(lag, 3))
+
+    def Status(self):
+        with self._lock:
+            return {"level": OVERLOAD_LEVELS[self.level], "depth": self.depth, "lag": self.lag, "since": self.since}
+
+
+Overload = OverloadController()
+# endregion
+
+# --- MQTT Command-Pipeline -------------------------------------------
+# region
+MQTT_SEND_QUEUE_MAX = 1000      # max. wartende Befehle, danach wird abgelehnt
+MQTT_MAX_INFLIGHT = 20          # max. unbestätigte QoS1-Nachrichten gleichzeitig
+MQTT_ACK_TIMEOUT = 10.0         # Sekunden bis ein fehlendes PUBACK gemeldet wird (paho wiederholt selbst)
+MQTT_MAX_RETRIES = 3            # nur für Befehle, die paho gar nicht erst angenommen hat
+MQTT_RETRY_BACKOFF = 2.0        # Sekunden, verdoppelt sich pro Versuch
+MQTT_RETRY_BACKOFF_MAX = 60.0
+MQTT_MODULE_MIN_GAP = 0.5       # Sekunden zwischen zwei Befehlen an dasselbe ESP32-Modul
+MQTT_ACKED_EARLY_MAX = 1000     # verspätete PUBACKs (mid schon abgelaufen) dürfen sich nicht ansammeln
+
+
+class OutboundCommand:
+    __slots__ = ("module_id", "topic", "payload", "qos", "attempts", "mid", "sent_at")
+
+    def __init__(self, module_id, topic, payload, qos):
+        self.module_id = module_id
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.attempts = 0
+        self.mid = None
+        self.sent_at = None
+
+
+class CommandPipeline:
+    """Ausgehende Befehle: begrenzte Queue, QoS1-Fenster, PUBACK-Tracking, Retry und Rate-Limit pro Modul."""
+
+    def __init__(self, mqtt_client, max_queue=MQTT_SEND_QUEUE_MAX, max_inflight=MQTT_MAX_INFLIGHT):
+        self.client = mqtt_client
+        self.max_queue = max_queue
+        self.max_inflight = max_inflight
+        self._cond = threading.Condition(threading.RLock())
+        self._ready = deque()
+        self._delayed = []          # Heap (bereit_ab, seq, cmd) für Retries und Rate-Limit
+        self._inflight = {}         # mid -> cmd
+        self._acked_early = OrderedDict()   # PUBACK kam bevor die mid registriert war (mid -> None)
+        self._last_sent = {}        # module_id -> Zeitpunkt des letzten Befehls
+        self._seq = itertools.count()
+        self.paused = False         # während eines Verbindungsabbruchs wird nichts gesendet
+        self.client.max_inflight_messages_set(max_inflight)
+        self._worker = threading.Thread(target=self._Run, name="mqtt-cmd-pipeline", daemon=True)
+        self._worker.start()
+
+    def Submit(self, module_id, topic, payload, qos=1):
+        with self._cond:
+            if len(self._ready) + len(self._delayed) >= self.max_queue:
+                print(f"Befehls-Queue voll, verworfen: {topic}")
+                return False
+            self._ready.append(OutboundCommand(module_id, topic, payload, qos))
+            self._cond.notify()
+        return True
+
+    def OnPublish(self, mid):
+        with self._cond:
+            cmd = self._inflight.pop(mid, None)
+            if cmd is None:
+                self._acked_early[mid] = None
+                if len(self._acked_early) > MQTT_ACKED_EARLY_MAX:
+                    self._acked_early.popitem(last=False)
+                return
+            self._cond.notify()
+        print(f"[{datetime.now().isoformat()}] MQTT zugestellt (mid {mid}) → {cmd.payload}")
+
+    def Pending(self):
+        with self._cond:
+            return len(self._ready) + len(self._delayed), len(self._inflight)
+
+    def Pause(self):
+        """Hält den Versand an und gibt alle noch nicht gesendeten Befehle in Reihenfolge zurück."""
+        with self._cond:
+            self.paused = True
+            pending = list(self._ready) + [cmd for _, _, cmd in sorted(self._delayed)]
+            self._ready.clear()
+            self._delayed.clear()
+            return pending
+
+    def Resume(self, commands=()):
+        # Offline gepufferte Befehle kommen vor allem, was inzwischen neu eingereiht wurde
+        with self._cond:
+            self._ready.extendleft(reversed(list(commands)))
+            now = systime.monotonic()
+            for cmd in self._inflight.values():
+                cmd.sent_at = now
+            self.paused = False
+            self._cond.notify()
+
+    def _Run(self):
+        # publish() braucht paho's _out_message_mutex, den der Netzwerk-Thread hält, während er
+        # on_publish -> OnPublish aufruft. Deshalb nie unter self._cond publishen (ABBA-Deadlock).
+        while True:
+            with self._cond:
+                cmd = self._NextCommand()
+            self._Publish(cmd)
+
+    def _NextCommand(self):
+        while True:
+            now = systime.monotonic()
+            self._ExpireInflight(now)
+            while self._delayed and self._delayed[0][0] <= now:
+                self._ready.append(heapq.heappop(self._delayed)[2])
+
+            if self._ready and not self.paused and len(self._inflight) < self.max_inflight:
+                cmd = self._ready.popleft()
+                gap = self._last_sent.get(cmd.module_id, -MQTT_MODULE_MIN_GAP) + MQTT_MODULE_MIN_GAP - now
+                if gap > 0:
+                    heapq.heappush(self._delayed, (now + gap, next(self._seq), cmd))
+                    continue
+                self._last_sent[cmd.module_id] = now
+                return cmd
+
+            wait = MQTT_ACK_TIMEOUT
+            if self._delayed:
+                wait = min(wait, self._delayed[0][0] - now)
+            self._cond.wait(timeout=max(wait, 0.01))
+
+    def _Publish(self, cmd):
+        cmd.attempts += 1
+        if Capture is not None:
+            Capture.Record("out", cmd.topic, cmd.payload)
+        result = self.client.publish(cmd.topic, cmd.payload, qos=cmd.qos)
+        with self._cond:
+            # Bei MQTT_ERR_NO_CONN hat paho eine QoS1-Nachricht trotzdem übernommen und sendet sie nach dem
+            # Reconnect selbst. Nur wenn paho sie abgelehnt hat (z.B. MQTT_ERR_QUEUE_SIZE), wird wiederholt.
+            if result.rc != MQTT_ERR_SUCCESS and (cmd.qos == 0 or result.rc != MQTT_ERR_NO_CONN):
+                print(f"Fehler beim Senden an MQTT: {result.rc}")
+                self._Retry(cmd)
+                return
+            if cmd.qos == 0 or result.mid in self._acked_early:
+                self._acked_early.pop(result.mid, None)
+                print(f"[{datetime.now().isoformat()}] MQTT → {cmd.payload}")
+            else:
+                cmd.mid = result.mid
+                cmd.sent_at = systime.monotonic()
+                self._inflight[cmd.mid] = cmd
+                print(f"[{datetime.now().isoformat()}] MQTT → {cmd.payload} (mid {cmd.mid})")
+        OnCommandPublished(cmd.module_id, cmd.payload)
+
+    def _ExpireInflight(self, now):
+        # Kein erneutes publish(): paho hält die QoS1-Nachricht bis zum PUBACK und wiederholt sie nach einem
+        # Reconnect selbst. Eine zweite Kopie unter neuer mid würde das Modul doppelt gießen lassen.
+        # Die Nachricht belegt weiter ihren Platz im Fenster, genau wie in paho's max_inflight.
+        if self.paused:
+            return
+        for cmd in self._inflight.values():
+            if cmd.sent_at is not None and now - cmd.sent_at > MQTT_ACK_TIMEOUT:
+                cmd.sent_at = None      # nur einmal melden, Resume() stellt die Überwachung wieder scharf
+                MetricInc("mqtt.puback_overdue")
+                print(f"Kein PUBACK für mid {cmd.mid} nach {MQTT_ACK_TIMEOUT}s, warte weiter auf paho")
+
+    def _Retry(self, cmd):
+        if cmd.attempts > MQTT_MAX_RETRIES:
+            print(f"Befehl nach {cmd.attempts} Versuchen verworfen: {cmd.payload}")
+            return
+        delay = min(MQTT_RETRY_BACKOFF * 2 ** (cmd.attempts - 1), MQTT_RETRY_BACKOFF_MAX)
+        heapq.heappush(self._delayed, (systime.monotonic() + delay, next(self._seq), cmd))
+
+# endregion
+
+# --- Metriken --------------------------------------------------------
+# region
+Metrics = {}
+MetricsLock = threading.Lock()
+
+def MetricInc(name, value=1):
+    with MetricsLock:
+        Metrics[name] = Metrics.get(name, 0) + value
+
+def MetricSet(name, value):
+    with MetricsLock:
+        Metrics[name] = value
+# endregion
+
+# --- Mitschnitt MQTT-Verkehr ------------------------------------------
+# region
+CAPTURE_FILE = os.environ.get("GREENTHUMB_CAPTURE")     # z.B. capture.jsonl.gz, leer = aus
+CAPTURE_VERSION = 1
+CAPTURE_FLUSH_SECONDS = 5.0
+
+
+class TrafficCapture:
+    """Schreibt eingehende Nachrichten und ausgehende Publishes als gzip-JSON-Zeilen [t, "in"|"out", topic, payload].
+
+    Die erste Zeile ist ein Header mit der Flotten-Konfiguration, damit replay.py denselben Aufbau herstellen kann.
+    """
+
+    def __init__(self, filename, fleet_config):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._file = gzip.open(filename, "wt", encoding="utf-8")
+        self._last_flush = systime.monotonic()
+        self.records = 0
+        self._Write({"capture": CAPTURE_VERSION, "t": clock.Time(), "fleet": fleet_config})
+        atexit.register(self.Close)
+
+    def _Write(self, record):
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(line)
+            now = systime.monotonic()
+            if now - self._last_flush > CAPTURE_FLUSH_SECONDS:
+                self._file.flush()
+                self._last_flush = now
+
+    def Record(self, direction, topic, payload):
+        if isinstance(payload, bytes):
+            payload = payload.decode("utf-8", "replace")
+        self._Write([round(clock.Time(), 3), direction, topic, payload])
+        self.records += 1
+
+    def Close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def ReadCapture(filename):
+    """(header, records) aus einer Mitschnitt-Datei."""
+    with gzip.open(filename, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline())
+        if header.get("capture") != CAPTURE_VERSION:
+            raise ValueError(f"Unbekannte Mitschnitt-Version: {header.get('capture')}")
+        return header, [json.loads(line) for line in f if line.strip()]
+
+
+Capture = None      # wird in start() angelegt, falls GREENTHUMB_CAPTURE gesetzt ist
+# endregion
+
+# --- Offline-Queue ----------------------------------------------------
+# region
+OFFLINE_QUEUE_DIR = "OfflineQueue"
+
+def _WateringKey(cmd):
+    # (module_id, Pot) für Gießbefehle, sonst None
+    try:
+        msg = json.loads(cmd.payload)
+    except (TypeError, ValueError):
+        return None
+    if isinstance(msg, dict) and msg.get("Type") == "RequestWatering":
+        return cmd.module_id, msg.get("Pot")
+    return None
+
+
+class OfflineQueue:
+    """Persistente FIFO für Befehle, die während eines Verbindungsabbruchs anfallen (JSON-Lines).
+
+    Pro (Modul, Pot) bleibt nur der neueste Gießbefehl stehen: der Scheduler läuft offline weiter und
+    sieht eingefrorene Feuchtewerte, nach Stunden käme sonst eine ganze Serie Gießvorgänge am Stück.
+    Alle anderen Befehle (z.B. Kalibrierung) bleiben in strikter FIFO-Reihenfolge.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.commands = []
+        if os.path.isfile(filename):
+            try:
+                with open(filename, "r", encoding="utf-8") as f:
+                    for line in f:
+                        if line.strip():
+                            d = json.loads(line)
+                            self.commands.append(OutboundCommand(d["module_id"], d["topic"], d["payload"], d["qos"]))
+                print(f"{len(self.commands)} offline commands restored from {filename}")
+            except Exception as e:
+                print(f"Error loading offline queue '{filename}': {e}")
+
+    def Extend(self, commands):
+        if not commands:
+            return
+        keys = {key for key in map(_WateringKey, commands) if key is not None}
+        superseded = 0
+        if keys:
+            kept = [cmd for cmd in self.commands if _WateringKey(cmd) not in keys]
+            superseded = len(self.commands) - len(kept)
+            self.commands = kept
+        # Innerhalb des neuen Blocks ebenfalls nur den letzten Befehl pro Pot behalten
+        last = {}
+        for i, cmd in enumerate(commands):
+            key = _WateringKey(cmd)
+            if key is not None:
+                last[key] = i
+        fresh = [cmd for i, cmd in enumerate(commands) if last.get(_WateringKey(cmd), i) == i]
+        superseded += len(commands) - len(fresh)
+        if superseded:
+            MetricInc("mqtt.offline_superseded", superseded)
+            print(f"Offline-Queue: {superseded} ältere Gießbefehle durch neuere ersetzt")
+
+        os.makedirs(os.path.dirname(self.filename) or ".", exist_ok=True)
+        with open(self.filename, "w" if superseded else "a", encoding="utf-8") as f:
+            for cmd in (self.commands + fresh) if superseded else fresh:
+                f.write(self._Line(cmd))
+        self.commands.extend(fresh)
+
+    @staticmethod
+    def _Line(cmd):
+        return json.dumps({"module_id": cmd.module_id, "topic": cmd.topic, "payload": cmd.payload, "qos": cmd.qos}) + "\n"
+
+    def Drain(self):
+        commands, self.commands = self.commands, []
+        if os.path.isfile(self.filename):
+            os.remove(self.filename)
+        return commands
+# endregion
+
+# --- MQTT Connection-Pool ---------------------------------------------
+# region
+MQTT_RECONNECT_MIN = 1.0        # Sekunden, verdoppelt sich pro Fehlversuch
+MQTT_RECONNECT_MAX = 120.0
+
+
+class MQTTShard:
+    """Eine Broker-Verbindung mit eigenem Netzwerk-Loop und eigener Command-Pipeline."""
+
+    def __init__(self, index, host, port, wildcard):
+        self.index = index
+        self.name = f"shard{index}@{host}:{port}"
+        self.host = host
+        self.port = port
+        self.wildcard = wildcard
+        self.topics = set()     # Einzel-Abos, falls kein Wildcard möglich ist
+        self.connected = False
+        self.down_since = systime.monotonic()
+        self.reconnect_attempt = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.offline = OfflineQueue(os.path.join(OFFLINE_QUEUE_DIR, f"shard{index}.jsonl"))
+        import paho.mqtt.client as mqtt
+        self.client = mqtt.Client(userdata=self)
+        self.client.on_connect = on_connect
+        self.client.on_disconnect = on_disconnect
+        self.client.on_message = on_message
+        self.client.on_publish = lambda c, u, mid: u.pipeline.OnPublish(mid)
+        self.pipeline = CommandPipeline(self.client)
+        self.pipeline.Pause()
+
+    def Connect(self):
+        threading.Thread(target=self._NetworkLoop, name=f"mqtt-{self.name}", daemon=True).start()
+
+    def Disconnect(self):
+        self._stop.set()
+        self.client.disconnect()
+
+    def _NetworkLoop(self):
+        # Eigener Loop statt loop_start(), damit auch der erste connect() mit Backoff wiederholt wird
+        socket_open = False
+        while not self._stop.is_set():
+            if not socket_open:
+                try:
+                    self.client.connect(self.host, self.port, 60)
+                    socket_open = True
+                except Exception as e:
+                    delay = self._BackoffDelay()
+                    print(f"MQTT Connection failed ({self.name}): {e}, retry in {delay:.1f}s")
+                    self._stop.wait(delay)
+                    continue
+            if self.client.loop(timeout=1.0) != MQTT_ERR_SUCCESS:
+                socket_open = False
+                self.OnDisconnected()
+                self._stop.wait(self._BackoffDelay())
+
+    def _BackoffDelay(self):
+        # Exponentiell mit Jitter, damit nicht alle Verbindungen gleichzeitig neu anklopfen
+        delay = min(MQTT_RECONNECT_MAX, MQTT_RECONNECT_MIN * 2 ** self.reconnect_attempt)
+        self.reconnect_attempt += 1
+        return delay * random.uniform(0.5, 1.0)
+
+    def OnConnected(self):
+        with self._lock:
+            self.Resubscribe()
+            outage = systime.monotonic() - self.down_since
+            self.reconnect_attempt = 0
+            self.connected = True
+            self.pipeline.Resume(self.offline.Drain())
+        MetricSet(f"mqtt.{self.name}.outage_seconds_last", outage)
+        MetricInc(f"mqtt.{self.name}.outage_seconds_total", outage)
+        print(f"MQTT {self.name}: Verbindung nach {outage:.1f}s wiederhergestellt")
+
+    def OnDisconnected(self):
+        with self._lock:
+            if not self.connected:
+                return
+            self.connected = False
+            self.down_since = systime.monotonic()
+            self.offline.Extend(self.pipeline.Pause())
+        MetricInc(f"mqtt.{self.name}.outages")
+
+    def Submit(self, module_id, topic, payload, qos=1):
+        with self._lock:
+            if not self.connected:
+                self.offline.Extend([OutboundCommand(module_id, topic, payload, qos)])
+                print(f"MQTT {self.name} offline, Befehl gepuffert: {topic}")
+                return True
+        return self.pipeline.Submit(module_id, topic, payload, qos)
+
+    def Resubscribe(self):
+        if self.wildcard:
+            self.client.subscribe(MQTT_RESP_WILDCARD)
+        else:
+            for topic in self.topics:
+                self.client.subscribe(topic)
+
+    def Subscribe(self, topic):
+        if not self.wildcard:
+            self.topics.add(topic)
+            self.client.subscribe(topic)
+
+    def Unsubscribe(self, topic):
+        if not self.wildcard:
+            self.topics.discard(topic)
+            self.client.unsubscribe(topic)
+
+
+class ConnectionPool:
+    """Verteilt Module per module_id auf mehrere MQTT-Verbindungen."""
+
+    def __init__(self, brokers):
+        # Wildcard nur, wenn der Broker von genau einer Verbindung genutzt wird,
+        # sonst käme jede Antwort auf jedem Socket doppelt an
+        self.shards = [MQTTShard(i, host, port, MQTT_WILDCARD_SUB and brokers.count((host, port)) == 1)
+                       for i, (host, port) in enumerate(brokers)]
+
+    def Register(self, routes):
+        # Module, die vor start() angelegt wurden, ihrer Verbindung zuordnen
+        for topic, (handler, module) in routes.items():
+            self.ShardFor(module.module_id).Subscribe(topic)
+
+    def ShardFor(self, module_id):
+        return self.shards[module_id % len(self.shards)]
+
+    def Submit(self, module_id, topic, payload, qos=1):
+        return self.ShardFor(module_id).Submit(module_id, topic, payload, qos)
+
+    def ConnectAll(self):
+        for shard in self.shards:
+            shard.Connect()
+
+    def DisconnectAll(self):
+        for shard in self.shards:
+            shard.Disconnect()
+
+
+pool = None     # wird in start() angelegt
+
+def SubmitCommand(module_id, topic, payload, qos=1):
+    if pool is None:
+        print(f"Backend nicht gestartet, Befehl verworfen: {topic}")
+        return False
+    return pool.Submit(module_id, topic, payload, qos)
+
+
+def OnCommandPublished(module_id, payload):
+    """Ein Befehl ist an paho übergeben. Erst jetzt wird ein Gießvorgang verbucht und überwacht:
+    offline gepufferte Befehle können noch durch neuere ersetzt werden (OfflineQueue)."""
+    try:
+        msg = json.loads(payload)
+    except (TypeError, ValueError):
+        return
+    if not isinstance(msg, dict) or msg.get("Type") != "RequestWatering":
+        return
+    module = Modules.get(module_id)
+    pot = module.pots.get(msg.get("Pot")) if module is not None else None
+    if pot is None:
+        return
+    Ledger.RecordRequested(pot, float(msg.get("Amount", pot.wat_amount)))
+    Alerts.OnWateringSent(pot)
 # endregion
 
 # --- Global Scheduler ------------------------------------------------
 # region 
-scheduler = BackgroundScheduler()
-scheduler.start()
+SCHED_ALIGN_SECONDS = 60        # Fälligkeiten auf ein Raster legen, damit viele Pots in einem Wakeup landen
+SCHED_JITTER_SECONDS = 5        # fester Versatz pro Job innerhalb des Rasters gegen Lastspitzen
+SCHED_MISFIRE_GRACE = 1800      # länger verpasste Termine werden übersprungen (wie misfire_grace_time)
+
+
+class ScheduledEntry:
+    __slots__ = ("key", "target", "interval", "handler", "due", "seq")
+
+    def __init__(self, key, target, interval, handler, due, seq):
+        self.key = key
+        self.target = target
+        self.interval = interval
+        self.handler = handler
+        self.due = due
+        self.seq = seq
+
+
+class WateringScheduler:
+    """Alle Intervalle in einem Heap mit einem Wakeup-Thread; fällige Einträge gehen gebündelt an ihren Handler.
+
+    Neu planen kostet O(log n): der alte Heap-Eintrag bleibt liegen und wird beim Herausnehmen
+    über die Sequenznummer als veraltet erkannt.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._heap = []         # (due, seq, key)
+        self._entries = {}      # key -> ScheduledEntry
+        self._seq = itertools.count()
+        self._thread = None
+
+    def Start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._Run, name="watering-scheduler", daemon=True)
+            self._thread.start()
+
+    def _Jitter(self, key):
+        # crc32 statt hash(): str-Hashes sind pro Prozess zufällig, Replays wären sonst nicht reproduzierbar
+        return (zlib.crc32(repr(key).encode()) % 1000) / 1000.0 * SCHED_JITTER_SECONDS
+
+    def _Align(self, key, t):
+        if SCHED_ALIGN_SECONDS <= 0:
+            return t
+        return -(-t // SCHED_ALIGN_SECONDS) * SCHED_ALIGN_SECONDS + self._Jitter(key)
+
+    def Schedule(self, key, target, interval, handler, delay=None):
+        """Plant target alle interval Sekunden (None = einmalig nach delay); gibt False zurück, wenn sich nichts ändert."""
+        with self._cond:
+            entry = self._entries.get(key)
+            if entry is not None and delay is None and entry.target is target \
+                    and entry.interval == interval and entry.handler is handler:
+                return False
+            first = delay if delay is not None else interval
+            now = clock.Time()
+            due = self._Align(key, now + first) if delay is None else now + first
+            entry = ScheduledEntry(key, target, interval, handler, due, next(self._seq))
+            self._entries[key] = entry
+            heapq.heappush(self._heap, (entry.due, entry.seq, key))
+            if self._heap[0][1] == entry.seq:
+                self._cond.notify()
+            return True
+
+    def ScheduleMany(self, items):
+        """Bulk-Variante von Schedule für (key, target, interval, handler); ein heapify statt n Pushes."""
+        changed = 0
+        with self._cond:
+            now = clock.Time()
+            for key, target, interval, handler in items:
+                entry = self._entries.get(key)
+                if entry is not None and entry.target is target and entry.interval == interval and entry.handler is handler:
+                    continue
+                entry = ScheduledEntry(key, target, interval, handler, self._Align(key, now + interval), next(self._seq))
+                self._entries[key] = entry
+                self._heap.append((entry.due, entry.seq, key))
+                changed += 1
+            if changed:
+                heapq.heapify(self._heap)
+                self._cond.notify()
+        return changed
+
+    def Cancel(self, key):
+        with self._cond:
+            return self._entries.pop(key, None) is not None
+
+    def NextRun(self, key):
+        with self._cond:
+            entry = self._entries.get(key)
+            return datetime.fromtimestamp(entry.due) if entry else None
+
+    def DueAt(self, key):
+        with self._cond:
+            entry = self._entries.get(key)
+            return entry.due if entry else None
+
+    def NextDue(self):
+        """Frühester Heap-Zeitpunkt (kann ein veralteter Eintrag sein), None bei leerem Heap."""
+        with self._cond:
+            return self._heap[0][0] if self._heap else None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _Run(self):
+        while True:
+            with self._cond:
+                batches = self._WaitDue()
+            self._Dispatch(batches)
+
+    def RunDue(self):
+        """Führt alle bis clock.Time() fälligen Einträge sofort aus (ohne Thread, z.B. im Replay)."""
+        with self._cond:
+            batches = self._PopDue(clock.Time())
+        self._Dispatch(batches)
+        return sum(len(targets) for targets in batches.values())
+
+    def _Dispatch(self, batches):
+        for handler, targets in batches.items():
+            try:
+                handler(targets)
+            except Exception as e:
+                print(f"Fehler im Scheduler-Handler {handler.__name__}: {e}")
+
+    def _WaitDue(self):
+        while True:
+            now = clock.Time()
+            batches = self._PopDue(now)
+            if batches:
+                return batches
+            timeout = self._heap[0][0] - now if self._heap else None
+            self._cond.wait(timeout=timeout)
+
+    def _PopDue(self, now):
+        batches = {}
+        while self._heap and self._heap[0][0] <= now:
+            due, seq, key = heapq.heappop(self._heap)
+            entry = self._entries.get(key)
+            if entry is None or entry.seq != seq:
+                continue    # veraltet (neu geplant oder gelöscht)
+            if now - due <= SCHED_MISFIRE_GRACE:
+                batches.setdefault(entry.handler, []).append(entry.target)
+            if entry.interval is None:
+                del self._entries[key]
+                continue
+            entry.due = due + entry.interval
+            if entry.due <= now:
+                entry.due = self._Align(key, now + entry.interval)
+            entry.seq = next(self._seq)
+            heapq.heappush(self._heap, (entry.due, entry.seq, key))
+        return batches
+
+
+def WaterPots(pots):
+    # Eine Feuchte-Prüfung über die fälligen Pots des Batches statt einer Entscheidung pro Pot
+    dry = Fleet.DryMask([pot._idx for pot in pots])
+    for pot, is_dry in zip(pots, dry):
+        try:
+            if pot.control_mode == "time" or is_dry:
+                pot.SendWatering()
+            else:
+                print(f"Pot {pot.module_pos} not watered due to moisture value")
+        except Exception as e:
+            print(f"Fehler beim Gießen von Pot {pot.module_pos}: {e}")
+
+
+scheduler = WateringScheduler()
+# endregion
+
+# --- Adaptive Gieß-Intervalle -----------------------------------------
+# region
+# Modus "adaptive": Trocknungsrate pro Pot aus den Feuchtewerten, nächster Check zur vorhergesagten
+# Schwellwert-Unterschreitung statt im festen Takt (siehe Pot.UpdateDryingRate / Pot.AdaptiveReschedule)
+ADAPTIVE_TAU = 6 * 3600             # Zeitkonstante der EWMA (Sekunden)
+ADAPTIVE_MIN_SPAN = 30 * 60         # so viel Messzeit, bevor eine Rate verwendet wird
+ADAPTIVE_JUMP = 3                   # Anstieg in % gilt als Gießen und geht nicht in die Rate ein
+ADAPTIVE_MIN_CHECK = 5 * 60         # frühester nächster Check
+ADAPTIVE_MAX_CHECK = 24 * 3600      # spätester nächster Check, auch wenn die Vorhersage weiter reicht
+ADAPTIVE_RESCHEDULE_MIN = 5 * 60    # kleinere Abweichungen vom geplanten Termin werden ignoriert ...
+ADAPTIVE_RESCHEDULE_FRAC = 0.2      # ... ebenso Abweichungen unter 20 % der Restzeit
+# endregion
+
+# --- Ereignis-Log -----------------------------------------------------
+# region
+APP_LOG_MAX = 200               # Einträge pro Modul, ältere fallen raus (Laufzeit über Monate)
+
+def LogEvent(module, message, type="INFO"):
+    # Gleiches Format wie das Logbuch in Visu (neuester Eintrag oben)
+    timestamp = clock.Now().strftime("%H:%M:%S")
+    module.app_log.insert(0, {"Zeit": timestamp, "Typ": type, "Nachricht": message})
+    del module.app_log[APP_LOG_MAX:]
+# endregion
+
+# --- Alarm-Regeln -----------------------------------------------------
+# region
+ALERT_TANK_LOW_PCT = 20         # Tank unter X %
+ALERT_TANK_HYSTERESIS = 5       # erst über X + 5 % wieder OK
+ALERT_DRY_DURATION = 6 * 3600   # Pot länger als Y Sekunden unter Schwellwert
+ALERT_MOIST_HYSTERESIS = 3
+ALERT_SENSOR_SILENT = 15 * 60   # keine Sensordaten seit Z Sekunden
+ALERT_WATERING_ACK = 120        # Sekunden bis zur RespWatering-Quittung (nur Module, die quittieren)
+ALERT_RISE_WINDOW = 30 * 60     # Zeitfenster, in dem die Feuchte nach dem Gießen steigen muss
+ALERT_RISE_MIN = 2              # Mindestanstieg in %
+
+
+class AlertEngine:
+    """Regeln werden nur bei Zustandsänderungen ausgewertet; Zeitbedingungen laufen als
+    einmalige Timer im Scheduler. Ein Alarm wird pro (Regel, Modul, Pot) nur einmal gemeldet
+    und erst nach Unterschreiten der Hysterese wieder aufgehoben.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.active = {}        # (regel, module_id, pos) -> {"since": ts, "message": ...}
+        self.dry_since = {}     # (module_id, pos) -> ts
+        self.rise_base = {}     # (module_id, pos) -> Feuchte beim Gießen
+        self.ack_modules = set()    # Module, deren Firmware RespWatering sendet (schon einmal empfangen)
+        self.last_seen = {}     # module_id -> Zeitpunkt der letzten Sensordaten
+
+    # --- Zustand melden / aufheben ---
+    def Raise(self, rule, module_id, pos, message):
+        key = (rule, module_id, pos)
+        with self._lock:
+            if key in self.active:
+                return False
+            self.active[key] = {"since": clock.Time(), "message": message}
+            MetricSet("alerts.active", len(self.active))
+        MetricInc(f"alerts.raised.{rule}")
+        module = Modules.get(module_id)
+        if module is not None:
+            LogEvent(module, message, "ALARM")
+        print(f"ALARM {rule} M{module_id}P{pos}: {message}")
+        return True
+
+    def Clear(self, rule, module_id, pos, message=None):
+        key = (rule, module_id, pos)
+        with self._lock:
+            if self.active.pop(key, None) is None:
+                return False
+            MetricSet("alerts.active", len(self.active))
+        MetricInc(f"alerts.cleared.{rule}")
+        module = Modules.get(module_id)
+        if module is not None and message:
+            LogEvent(module, message, "OK")
+        return True
+
+    def Active(self, module_id=None):
+        with self._lock:
+            return {k: dict(v) for k, v in self.active.items() if module_id is None or k[1] == module_id}
+
+    def _Timer(self, rule, module_id, pos, delay):
+        scheduler.Schedule(("alert", rule, module_id, pos), (rule, module_id, pos), None, self.OnTimers, delay=delay)
+
+    def _CancelTimer(self, rule, module_id, pos):
+        scheduler.Cancel(("alert", rule, module_id, pos))
+
+    # --- Ereignisse ---
+    def OnModuleAdded(self, module):
+        self.last_seen[module.module_id] = clock.Time()
+        self._Timer("sensor_silent", module.module_id, 0, ALERT_SENSOR_SILENT)
+
+    def OnSensorData(self, module):
+        mid = module.module_id
+        # Totmann-Timer: nur den Zeitstempel setzen. Ein Timer pro Modul prüft beim Ablauf last_seen
+        # und zieht sich selbst um die Restzeit nach, statt pro Nachricht einen Heap-Eintrag zu erzeugen.
+        self.last_seen[mid] = clock.Time()
+        if scheduler.DueAt(("alert", "sensor_silent", mid, 0)) is None:
+            self._Timer("sensor_silent", mid, 0, ALERT_SENSOR_SILENT)
+        self.Clear("sensor_silent", mid, 0, "Sensordaten wieder empfangen")
+
+        lvl = module.TankLvl
+        if lvl is not None:
+            if lvl < ALERT_TANK_LOW_PCT:
+                self.Raise("tank_low", mid, 0, f"Wassertank niedrig: {lvl:.0f}%")
+            elif lvl > ALERT_TANK_LOW_PCT + ALERT_TANK_HYSTERESIS:
+                self.Clear("tank_low", mid, 0, f"Wassertank wieder bei {lvl:.0f}%")
+
+        now = clock.Time()
+        for pos, pot in list(module.pots.items()):
+            moist = pot.moist_value
+            with self._lock:
+                if moist <= pot.moist_thresh:
+                    if (mid, pos) not in self.dry_since:
+                        self.dry_since[(mid, pos)] = now
+                        self._Timer("pot_dry", mid, pos, ALERT_DRY_DURATION)
+                elif moist > pot.moist_thresh + ALERT_MOIST_HYSTERESIS and self.dry_since.pop((mid, pos), None) is not None:
+                    self._CancelTimer("pot_dry", mid, pos)
+                    self.Clear("pot_dry", mid, pos, f"{pot.name} wieder feucht ({moist:.0f}%)")
+                base = self.rise_base.get((mid, pos))
+                if base is not None and moist >= base + ALERT_RISE_MIN:
+                    del self.rise_base[(mid, pos)]
+                    self._CancelTimer("no_rise", mid, pos)
+                    self.Clear("no_rise", mid, pos, f"{pot.name}: Feuchte steigt wieder")
+
+    def OnWateringSent(self, pot):
+        mid, pos = pot.module.module_id, pot.module_pos
+        # Ältere Firmware quittiert nicht; ohne diese Prüfung stünde nach jedem Gießen ein Dauer-Alarm
+        if mid in self.ack_modules:
+            self._Timer("watering_unacked", mid, pos, ALERT_WATERING_ACK)
+        base = pot.moist_value
+        if base + ALERT_RISE_MIN > 100:
+            return      # schon nass: gegen die 100 %-Grenze kann die Feuchte nicht mehr steigen
+        with self._lock:
+            self.rise_base[(mid, pos)] = base
+        self._Timer("no_rise", mid, pos, ALERT_RISE_WINDOW)
+
+    def OnWateringAck(self, pot):
+        mid, pos = pot.module.module_id, pot.module_pos
+        self.ack_modules.add(mid)
+        self._CancelTimer("watering_unacked", mid, pos)
+        self.Clear("watering_unacked", mid, pos, f"{pot.name}: Gießbefehl quittiert")
+
+    def OnTimers(self, keys):
+        # Batch aus dem Scheduler: Bedingung beim Ablauf noch einmal prüfen
+        for rule, mid, pos in keys:
+            module = Modules.get(mid)
+            if module is None:
+                continue
+            pot = module.pots.get(pos)
+            if rule == "sensor_silent":
+                silent = clock.Time() - self.last_seen.get(mid, 0.0)
+                if silent < ALERT_SENSOR_SILENT:
+                    self._Timer(rule, mid, 0, ALERT_SENSOR_SILENT - silent)
+                else:
+                    self.Raise(rule, mid, 0, f"Keine Sensordaten seit {ALERT_SENSOR_SILENT // 60} min")
+            elif rule == "pot_dry" and pot is not None and (mid, pos) in self.dry_since:
+                self.Raise(rule, mid, pos, f"{pot.name} seit {ALERT_DRY_DURATION // 3600} h trocken")
+            elif rule == "watering_unacked" and pot is not None:
+                self.Raise(rule, mid, pos, f"{pot.name}: Gießbefehl nicht quittiert")
+            elif rule == "no_rise" and pot is not None and (mid, pos) in self.rise_base:
+                self.Raise(rule, mid, pos, f"{pot.name}: Feuchte steigt nach dem Gießen nicht")
+
+    def Forget(self, module_id, pos=None):
+        with self._lock:
+            for key in [k for k in self.active if k[1] == module_id and (pos is None or k[2] == pos)]:
+                del self.active[key]
+            for d in (self.dry_since, self.rise_base):
+                for key in [k for k in d if k[0] == module_id and (pos is None or k[1] == pos)]:
+                    del d[key]
+            if pos is None:
+                self.ack_modules.discard(module_id)
+                self.last_seen.pop(module_id, None)
+        rules = ("pot_dry", "watering_unacked", "no_rise") if pos is not None else \
+            ("sensor_silent", "tank_low", "pot_dry", "watering_unacked", "no_rise")
+        for rule in rules:
+            for p in ([pos] if pos is not None else range(POTS_PER_MODULE + 1)):
+                self._CancelTimer(rule, module_id, p)
+
+
+Alerts = AlertEngine()
+# endregion
+
+# --- Wasserverbrauch --------------------------------------------------
+# region
+LEDGER_WINDOWS = {"24h": 24, "7d": 7 * 24, "30d": 30 * 24}     # in Stunden-Buckets
+LEDGER_BUCKETS = max(LEDGER_WINDOWS.values())
+
+
+class RollingSum:
+    """Gleitende Summen über LEDGER_WINDOWS aus Stunden-Buckets in einem Ring.
+
+    Jede Fenstersumme wird beim Stundenwechsel um den herausfallenden Bucket korrigiert,
+    Lesen ist damit O(1) statt Aufsummieren eines Logs.
+    """
+
+    __slots__ = ("hour", "buckets", "totals", "lifetime", "since")
+
+    def __init__(self):
+        self.hour = None
+        self.since = None       # Zeitpunkt des ersten Werts (Fenster sind bis dahin nur teilweise gefüllt)
+        # array statt Liste: feste Größe ab dem ersten Wert, keine float-Objekte pro belegter Stunde
+        self.buckets = array("d", bytes(8 * LEDGER_BUCKETS))
+        self.totals = dict.fromkeys(LEDGER_WINDOWS, 0.0)
+        self.lifetime = 0.0
+
+    def _Advance(self, hour):
+        if self.hour is None or hour - self.hour >= LEDGER_BUCKETS:
+            self.buckets = array("d", bytes(8 * LEDGER_BUCKETS))
+            self.totals = dict.fromkeys(LEDGER_WINDOWS, 0.0)
+        else:
+            for h in range(self.hour + 1, hour + 1):
+                for name, width in LEDGER_WINDOWS.items():
+                    self.totals[name] -= self.buckets[(h - width) % LEDGER_BUCKETS]
+                self.buckets[h % LEDGER_BUCKETS] = 0.0
+        self.hour = hour
+
+    def Add(self, value, t):
+        if self.since is None:
+            self.since = t
+        hour = int(t // 3600)
+        if self.hour is None or hour > self.hour:
+            self._Advance(hour)
+        # Verspätete Werte zählen zur aktuellen Stunde
+        self.buckets[self.hour % LEDGER_BUCKETS] += value
+        for name in self.totals:
+            self.totals[name] += value
+        self.lifetime += value
+
+    def Totals(self, t):
+        hour = int(t // 3600)
+        if self.hour is not None and hour > self.hour:
+            self._Advance(hour)
+        return dict(self.totals, total=self.lifetime)
+
+    def Covered(self, t):
+        """Stunden seit dem ersten Wert (mindestens 1), also wie viel eines Fensters tatsächlich belegt ist."""
+        if self.since is None:
+            return 0.0
+        return max(1.0, (t - self.since) / 3600)
+
+    def State(self):
+        # Nur belegte Buckets, damit der Snapshot klein bleibt
+        return [self.hour, {h: v for h, v in enumerate(self.buckets) if v}, self.lifetime, self.since]
+
+    @classmethod
+    def FromState(cls, state):
+        r = cls()
+        r.hour, buckets, r.lifetime = state[:3]
+        if len(state) > 3:
+            r.since = state[3]
+        elif buckets and r.hour is not None:
+            # Ältere Snapshots ohne Startzeitpunkt: Beginn der ältesten belegten Stunde im Ring
+            r.since = (r.hour - max((r.hour - int(h)) % LEDGER_BUCKETS for h in buckets)) * 3600.0
+        for h, v in buckets.items():
+            r.buckets[int(h)] = v
+        if r.hour is not None:
+            for name, width in LEDGER_WINDOWS.items():
+                r.totals[name] = sum(r.buckets[(r.hour - i) % LEDGER_BUCKETS] for i in range(width))
+        return r
+
+
+class WaterLedger:
+    """Verbrauch pro Pot, Modul und Flotte: angefordert (RequestWatering) und geliefert (Durchflussmesser)."""
+
+    KINDS = ("requested", "delivered")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.sums = {}      # (kind, scope) -> RollingSum, scope = ("pot", mid, pos) | ("module", mid) | ("fleet",)
+
+    def _Add(self, kind, module_id, pos, ml, t=None):
+        t = clock.Time() if t is None else t
+        with self._lock:
+            for scope in (("pot", module_id, pos), ("module", module_id), ("fleet",)):
+                rolling = self.sums.get((kind, scope))
+                if rolling is None:
+                    rolling = self.sums[(kind, scope)] = RollingSum()
+                rolling.Add(ml, t)
+
+    def RecordRequested(self, pot, ml, t=None):
+        self._Add("requested", pot.module.module_id, pot.module_pos, ml, t)
+
+    def RecordDelivered(self, pot, ml, t=None):
+        self._Add("delivered", pot.module.module_id, pot.module_pos, ml, t)
+
+    def Totals(self, kind, scope, t=None):
+        with self._lock:
+            rolling = self.sums.get((kind, scope))
+            if rolling is None:
+                return dict.fromkeys(list(LEDGER_WINDOWS) + ["total"], 0.0)
+            return rolling.Totals(clock.Time() if t is None else t)
+
+    def _UsageKind(self, scope, t):
+        return "delivered" if self.Totals("delivered", scope, t)["total"] > 0 else "requested"
+
+    def Usage(self, scope, t=None):
+        """Gelieferte Menge, solange kein Durchflussmesser meldet die angeforderte."""
+        return self.Totals(self._UsageKind(scope, t), scope, t)
+
+    def ForecastDepletion(self, module, t=None):
+        """Stunden bis der Tank leer ist, aus dem Verbrauch der letzten 7 Tage; None ohne Daten."""
+        if module.TankLvl is None:
+            return None
+        t = clock.Time() if t is None else t
+        scope = ("module", module.module_id)
+        kind = self._UsageKind(scope, t)
+        with self._lock:
+            rolling = self.sums.get((kind, scope))
+            hours = rolling.Covered(t) if rolling is not None else 0.0
+        if hours <= 0:
+            return None
+        # In der ersten Woche nur durch die tatsächlich belegten Stunden teilen, nicht durch volle 168 h
+        rate = self.Totals(kind, scope, t)["7d"] / min(LEDGER_WINDOWS["7d"], hours)
+        if rate <= 0:
+            return None
+        return max(0.0, module.TankLvl) / 100.0 * module.TankCapacity / rate
+
+    def Forget(self, module_id, pos=None):
+        with self._lock:
+            for key in [k for k in self.sums if k[1][0] != "fleet" and k[1][1] == module_id
+                        and (pos is None or k[1] == ("pot", module_id, pos))]:
+                del self.sums[key]
+
+    def State(self):
+        with self._lock:
+            return [[kind, list(scope), rolling.State()] for (kind, scope), rolling in self.sums.items()]
+
+    def LoadState(self, state):
+        with self._lock:
+            for kind, scope, rolling in state:
+                self.sums[(kind, tuple(scope))] = RollingSum.FromState(rolling)
+
+
+Ledger = WaterLedger()
 # endregion
 
 # --- Create Modules, global function -----------------------
 # region 
 Modules = {}
-def AddModule(module_id, name):
+def AddModule(module_id, name, verbose=True):
     module = Module(module_id, name)
+    module.TankLvlMin, module.TankLvlMax = Calibration.Bounds(module_id, TANK_SENSOR_POS)
     Modules[module_id] = module
-    topic = f"{MQTT_SuperTOPIC}/Module{module_id}/resp"
-    client.subscribe(topic)
-    print(f"Module{module_id} added. subscribed to topic {topic}")
+    topic = RespTopic(module_id)
+    TopicRoutes[topic] = (BufferModuleMessage, module)
+    if pool is not None:
+        pool.ShardFor(module_id).Subscribe(topic)
+    Alerts.OnModuleAdded(module)
+    if verbose:
+        print(f"Module{module_id} added. routed topic {topic}")
     return module
+
+def RemoveModule(module_id):
+    module = Modules.get(module_id)
+    if module is None:
+        return False
+    # Pots zuerst löschen, damit auch die Scheduler-Jobs verschwinden
+    for pot_pos in list(module.pots.keys()):
+        module.DeletePot(pot_pos)
+    topic = RespTopic(module_id)
+    TopicRoutes.pop(topic, None)
+    if pool is not None:
+        pool.ShardFor(module_id).Unsubscribe(topic)
+    Fleet.RemoveModule(module_id)
+    History.Drop(module_id)
+    Alerts.Forget(module_id)
+    Ledger.Forget(module_id)
+    del Modules[module_id]
+    print(f"Module{module_id} removed.")
+    return True
 #endregion
 
 def ProcessBufferData(module, msg):
@@ -263,39 +1986,126 @@ def ProcessBufferData(module, msg):
         ProcessSensorData(module, msg)
     elif m_type == "RespCalibration":
         ProcessCalibrationData(module, msg)
+    elif m_type == "RespWatering":
+        ProcessWateringAck(module, msg)
     else:
         print(f"unknown message type: {m_type}")
 
 
+def ProcessBuffers():
+    # Arbeitet die Empfangspuffer aller Module ab; gibt die Anzahl abgearbeiteter Nachrichten zurück.
+    # Eine zusammengefasste Messung (Überlast) ersetzt ältere gepufferte Messungen desselben Moduls
+    # und wird vor neueren Nachrichten verarbeitet, damit nichts Veraltetes zuletzt geschrieben wird.
+    count = 0
+    lag = 0.0
+    now = clock.Time()
+    slots = Overload.TakeCoalesced()
+    try:
+        for module in list(Modules.values()):
+            slot = slots.pop(module, None)
+            buf = module.MQTT_buffer
+            while buf:
+                t, msg = buf.popleft()
+                count += 1
+                if slot is not None:
+                    if t > slot[1]:
+                        lag = max(lag, now - slot[0])
+                        _ProcessGuarded(module, slot[2])
+                        count += 1
+                        slot = None
+                    elif msg.get("Type") == "CycSensorValues":
+                        MetricInc("overload.coalesced")
+                        continue
+                lag = max(lag, now - t)
+                _ProcessGuarded(module, msg)
+            if slot is not None:
+                lag = max(lag, now - slot[0])
+                _ProcessGuarded(module, slot[2])
+                count += 1
+        count += len(slots)     # Module, die inzwischen entfernt wurden
+    finally:
+        # Auch bei einem Abbruch abziehen, was schon aus den Puffern genommen wurde, sonst wächst depth für immer
+        Overload.OnProcessed(count, lag)
+    return count
+
+
+def _ProcessGuarded(module, msg):
+    # Eine fehlerhafte Nachricht (z.B. RespCalibration für einen unbekannten Pot) darf den Durchlauf nicht abbrechen
+    try:
+        ProcessBufferData(module, msg)
+    except Exception as e:
+        MetricInc("mqtt.process_errors")
+        print(f"Fehler beim Verarbeiten der Nachricht von Modul {module.module_id}: {e} ({msg})")
+
+
+BUFFER_PROCESS_INTERVAL = 1.0   # Sekunden; spätestens dann wird auch ohne Weckruf abgearbeitet
+
+
+class BufferProcessor:
+    """Arbeitet die Empfangspuffer im Hintergrund ab, unabhängig davon, ob jemand die Visu offen hat.
+
+    on_message weckt den Thread über Wake(); Regeln, Alarme und Gieß-Entscheidungen sehen damit
+    immer aktuelle Messwerte.
+    """
+
+    def __init__(self, interval=BUFFER_PROCESS_INTERVAL):
+        self.interval = interval
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._Run, name="buffer-processor", daemon=True)
+        self._thread.start()
+
+    def Wake(self):
+        self._wake.set()
+
+    def _Run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                ProcessBuffers()
+            except Exception as e:
+                print(f"Fehler beim Abarbeiten der Empfangspuffer: {e}")
+
+
+buffer_processor = None     # wird in start() angelegt
+
+
 def ReqestCalibration(module_id, sensor, pot, minORmax):
-    cur_cmd_timestamp = datetime.now()
+    cur_cmd_timestamp = clock.Now()
     payload = json.dumps({"Type": "RequestCalibration", "time_stamp": cur_cmd_timestamp.isoformat(), "sensor": sensor, "pot": pot, "minORmax": minORmax})
     topic = f"{MQTT_SuperTOPIC}/Module{module_id}/cmd"
-    result = client.publish(topic, payload, qos=1)
-
-    status = result[0]
-    if status == 0:
+    if SubmitCommand(module_id, topic, payload):
         print(f"[{datetime.now().isoformat()}] calibration values requested for {sensor}")
-    else:
-        print(f"Fehler beim Senden an MQTT: {status}")
+
+def ProcessWateringAck(module, msg):
+    # Quittung des ESP32 auf RequestWatering: {"Type": "RespWatering", "Pot": n, ...}
+    pot = module.pots.get(int(msg.get("Pot", 0)))
+    if pot is None:
+        print(f"RespWatering für unbekannten Pot: {msg}")
+        return
+    Alerts.OnWateringAck(pot)
+    # Durchflussmesser: tatsächlich geförderte Menge, falls der ESP32 sie mitschickt
+    if "Flow" in msg:
+        Ledger.RecordDelivered(pot, float(msg["Flow"]))
+
 
 def ProcessCalibrationData(module, msg):
+    if msg["minORmax"] not in ("min", "max"):
+        print(f"minORmax unknown")
+        return
     match msg["sensor"]:
         case "Plvl":
-            if msg["minORmax"] == "min":
-                module.TankLvlMin = int(msg["value"])
-            elif msg["minORmax"] == "max":
-                module.TankLvlMax = int(msg["value"])
-            else:
-                print(f"minORmax unknown")
+            Calibration.Set(module.module_id, TANK_SENSOR_POS, msg["minORmax"], int(msg["value"]))
+            module.TankLvlMin, module.TankLvlMax = Calibration.Bounds(module.module_id, TANK_SENSOR_POS)
+            # Aktuellen Wert mit der neuen Tabelle neu berechnen
+            if module.TankLvlRaw is not None:
+                module.TankLvl = Calibration.Table(module.module_id, TANK_SENSOR_POS).Apply(module.TankLvlRaw)
         case "Moist":
             pot = module.pots[int(msg["Pot"])] 
-            if msg["minORmax"] == "min":
-                pot.moist_min = int(msg["value"])
-            elif msg["minORmax"] == "max":
-                pot.moist_max = int(msg["value"])
-            else:
-                print(f"minORmax unknown")
+            Calibration.Set(module.module_id, pot.module_pos, msg["minORmax"], int(msg["value"]))
+            pot.moist_min, pot.moist_max = Calibration.Bounds(module.module_id, pot.module_pos)
+            if pot.moist_raw is not None:
+                pot.moist_value = Calibration.Table(module.module_id, pot.module_pos).Apply(pot.moist_raw)
        
 
     
@@ -305,44 +2115,762 @@ def ProcessSensorData(module, msg):
         p_lvl = int(msg.get("PLvl", 0))
         p_ref = int(msg.get("PRef", 0))
         LvlRaw = p_lvl - p_ref
-        
-        # Vermeidung Division durch Null
-        denom = module.TankLvlMax if module.TankLvlMax != 0 else 100
-        module.TankLvl = (LvlRaw - module.TankLvlMin)*100/denom
+
+        # Rohwert bleibt erhalten, Prozent kommt aus der vorberechneten Kalibriertabelle
+        module.TankLvlRaw = LvlRaw
+        module.TankLvl = Calibration.Table(module.module_id, TANK_SENSOR_POS).Apply(LvlRaw)
+        now = clock.Time()
+        History.Record(("tank", module.module_id), now, module.TankLvl)
 
         for i in range(1, 5):
             key = f"MPot{i}"
             if key in msg and i in module.pots:
-                module.pots[i].moist_value = int(msg[key])
+                raw = int(msg[key])
+                pot = module.pots[i]
+                pot.moist_raw = raw
+                pot.moist_value = Calibration.Table(module.module_id, i).Apply(raw)
+                History.Record(("moist", module.module_id, i), now, pot.moist_value)
+                pot.UpdateDryingRate(now)
+                if pot.control_mode == "adaptive":
+                    pot.AdaptiveReschedule(now)
+        Alerts.OnSensorData(module)
     except Exception as e:
         print(f"Fehler in SensorData: {e}")
 
-# --- instantiate objects, TO BE REPLACED BY UI INPUT!!! -----------------------
+# --- Verlauf / Historie --------------------------------------------------
+# region
+HISTORY_MAX_AGE = 30 * 24 * 3600    # Sekunden
+HISTORY_RAW_AGE = 24 * 3600         # so lange bleiben alle Messwerte erhalten, danach nur Min/Max pro Bucket
+HISTORY_BUCKET = 30 * 60            # Sekunden pro Min/Max-Bucket
+HISTORY_MAX_SAMPLES = 50000         # pro Zeitreihe (Rohwerte)
+HISTORY_CACHE_SIZE = 256
+HISTORY_RANGES = {"1h": 3600, "24h": 24 * 3600, "7d": 7 * 24 * 3600, "30d": 30 * 24 * 3600}
+
+
+def Downsample(xs, ys, n_out):
+    """LTTB (Largest-Triangle-Three-Buckets): reduziert auf n_out Punkte und erhält Spitzen und Form."""
+    n = len(xs)
+    if n <= n_out or n_out < 3:
+        return list(xs), list(ys)
+    every = (n - 2) / (n_out - 2)
+    if np is not None:
+        X = np.asarray(xs, dtype=np.float64)
+        Y = np.asarray(ys, dtype=np.float64)
+        # Kumulierte Summen -> Bucket-Mittelwert in O(1)
+        cx = np.concatenate(([0.0], np.cumsum(X)))
+        cy = np.concatenate(([0.0], np.cumsum(Y)))
+    keep = [0]
+    a = 0
+    for i in range(n_out - 2):
+        start, end = int(i * every) + 1, int((i + 1) * every) + 1
+        nxt_end = min(int((i + 2) * every) + 1, n)
+        if np is not None:
+            avg_x = (cx[nxt_end] - cx[end]) / (nxt_end - end)
+            avg_y = (cy[nxt_end] - cy[end]) / (nxt_end - end)
+            areas = np.abs((X[a] - avg_x) * (Y[start:end] - Y[a]) - (X[a] - X[start:end]) * (avg_y - Y[a]))
+            a = start + int(np.argmax(areas))
+        else:
+            avg_x = sum(xs[end:nxt_end]) / (nxt_end - end)
+            avg_y = sum(ys[end:nxt_end]) / (nxt_end - end)
+            ax, ay = xs[a], ys[a]
+            a = max(range(start, end), key=lambda j: abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay)))
+        keep.append(a)
+    keep.append(n - 1)
+    return [xs[j] for j in keep], [ys[j] for j in keep]
+
+
+class TimeSeries:
+    """Rohwerte der letzten HISTORY_RAW_AGE, davor Min- und Max-Punkt pro HISTORY_BUCKET.
+
+    Alle Spalten sind array("d") (8 Byte pro Wert statt eines float-Objekts pro Wert in einer Liste).
+    """
+    __slots__ = ("ts", "values", "old_ts", "old_values", "version")
+
+    def __init__(self):
+        self.ts = array("d")
+        self.values = array("d")
+        self.old_ts = array("d")
+        self.old_values = array("d")
+        self.version = 0
+
+    def Append(self, t, value):
+        self.ts.append(t)
+        self.values.append(value)
+        self.version += 1
+        # Gekürzt wird blockweise, damit das Löschen am Array-Anfang amortisiert O(1) bleibt
+        if len(self.ts) > HISTORY_MAX_SAMPLES * 1.25 or t - self.ts[0] > HISTORY_RAW_AGE * 1.25:
+            # An einer Bucket-Grenze schneiden, damit kein Bucket auf zwei Verdichtungen verteilt wird
+            edge = (t - HISTORY_RAW_AGE) // HISTORY_BUCKET * HISTORY_BUCKET
+            cut = max(len(self.ts) - HISTORY_MAX_SAMPLES, bisect_left(self.ts, edge))
+            self._Compact(cut)
+            del self.ts[:cut]
+            del self.values[:cut]
+        if self.old_ts and t - self.old_ts[0] > HISTORY_MAX_AGE * 1.25:
+            cut = bisect_left(self.old_ts, t - HISTORY_MAX_AGE)
+            del self.old_ts[:cut]
+            del self.old_values[:cut]
+
+    def _Compact(self, cut):
+        # Rohwerte [0, cut) -> pro Bucket Minimum und Maximum in zeitlicher Reihenfolge (Spitzen bleiben sichtbar)
+        ts, values = self.ts, self.values
+        start = 0
+        while start < cut:
+            bucket = ts[start] // HISTORY_BUCKET
+            end = start + 1
+            while end < cut and ts[end] // HISTORY_BUCKET == bucket:
+                end += 1
+            lo = min(range(start, end), key=values.__getitem__)
+            hi = max(range(start, end), key=values.__getitem__)
+            for i in sorted({lo, hi}):
+                self.old_ts.append(ts[i])
+                self.old_values.append(values[i])
+            start = end
+
+    def Range(self, t_from):
+        i = bisect_left(self.old_ts, t_from)
+        j = bisect_left(self.ts, t_from)
+        return self.old_ts[i:] + self.ts[j:], self.old_values[i:] + self.values[j:]
+
+
+class HistoryStore:
+    """Zeitreihen für Tank und Feuchte; Abfragen liefern gecachte, auf n Punkte reduzierte Kurven."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.series = {}                # ("tank", mid) / ("moist", mid, pos) -> TimeSeries
+        self._cache = OrderedDict()     # (key, range, n, version) -> (ts, values)
+
+    def Record(self, key, t, value):
+        if value is None:
+            return
+        with self._lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = TimeSeries()
+            series.Append(t, value)
+
+    def Drop(self, module_id, pos=None):
+        with self._lock:
+            for key in [k for k in self.series if k[1] == module_id and (pos is None or k[2:] == (pos,))]:
+                del self.series[key]
+
+    def Query(self, key, range_seconds, n_points=300):
+        """(Zeitstempel, Werte) der letzten range_seconds, höchstens n_points Punkte."""
+        with self._lock:
+            series = self.series.get(key)
+            if series is None:
+                return [], []
+            cache_key = (key, range_seconds, n_points, series.version)
+            hit = self._cache.get(cache_key)
+            if hit is not None:
+                self._cache.move_to_end(cache_key)
+                return hit
+            ts, values = series.Range(clock.Time() - range_seconds)
+        result = Downsample(ts, values, n_points)
+        with self._lock:
+            self._cache[cache_key] = result
+            while len(self._cache) > HISTORY_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return result
+
+
+History = HistoryStore()
+# endregion
+
+# --- Snapshot / Warmstart ---------------------------------------------
+# region
+SNAPSHOT_FILE = "state_snapshot.json"
+SNAPSHOT_INTERVAL = 60          # Sekunden zwischen zwei Snapshots
+SNAPSHOT_VERSION = 1
+
+
+def BuildSnapshot():
+    modules = []
+    for module in list(Modules.values()):
+        modules.append({
+            "id": module.module_id,
+            "name": module.name,
+            "tank_raw": module.TankLvlRaw,
+            "tank_lvl": module.TankLvl,
+            "tank_capacity": module.TankCapacity,
+            "app_log": list(module.app_log),
+            "pots": [{
+                "pos": pot.module_pos,
+                "name": pot.name,
+                "control_mode": pot.control_mode,
+                "wat_amount": pot.wat_amount,
+                "wat_event_cyc": pot.wat_event_cyc,
+                "moist_thresh": pot.moist_thresh,
+                "moist_value": pot.moist_value,
+                "moist_raw": pot.moist_raw,
+                "last_wat_event": pot.last_wat_event.timestamp() if pot.last_wat_event else None,
+                "drying": [pot.rls_w, pot.rls_t, pot.rls_tt, pot.rls_m, pot.rls_tm, pot.sample_t, pot.sample_moist],
+            } for pot in list(module.pots.values())],
+        })
+    return {"version": SNAPSHOT_VERSION, "saved_at": systime.time(), "modules": modules, "ledger": Ledger.State()}
+
+
+def SaveSnapshot(filename=SNAPSHOT_FILE, snap=None):
+    """Schreibt den Snapshot atomar (Temp-Datei + os.replace); gibt die Bytes zurück."""
+    data = json.dumps(snap or BuildSnapshot(), separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    tmp = filename + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, filename)
+    return data
+
+
+def LoadSnapshot(filename=SNAPSHOT_FILE):
+    """Stellt Module, Pots und letzte Messwerte aus dem Snapshot wieder her; False wenn keiner da ist."""
+    if not os.path.isfile(filename):
+        return False
+    try:
+        with open(filename, "rb") as f:
+            snap = json.loads(f.read())
+        if snap.get("version") != SNAPSHOT_VERSION:
+            print(f"Snapshot version {snap.get('version')} not supported")
+            return False
+        to_schedule = []
+        for m in snap["modules"]:
+            module = AddModule(m["id"], m["name"], verbose=False)
+            module.app_log = m.get("app_log", [])[:APP_LOG_MAX]
+            module.TankLvlRaw = m.get("tank_raw")
+            module.TankLvl = m.get("tank_lvl")
+            module.TankCapacity = m.get("tank_capacity", TANK_CAPACITY_ML)
+            for p in m["pots"]:
+                pot = module.AddPot(p["pos"], p["name"], p["control_mode"], p["wat_amount"], p["wat_event_cyc"], p["moist_thresh"],
+                                    schedule=False, verbose=False)
+                to_schedule.append((pot.JobKey(), pot, pot.wat_event_cyc * 60, WaterPots))
+                pot.moist_value = p.get("moist_value", 0)
+                pot.moist_raw = p.get("moist_raw")
+                if p.get("last_wat_event") is not None:
+                    pot.last_wat_event = datetime.fromtimestamp(p["last_wat_event"])
+                if p.get("drying"):
+                    pot.rls_w, pot.rls_t, pot.rls_tt, pot.rls_m, pot.rls_tm, pot.sample_t, pot.sample_moist = p["drying"]
+        scheduler.ScheduleMany(to_schedule)
+        Ledger.LoadState(snap.get("ledger", []))
+        age = systime.time() - snap.get("saved_at", systime.time())
+        print(f"Snapshot loaded: {len(snap['modules'])} modules, {age:.0f}s old")
+        return True
+    except Exception as e:
+        print(f"Error loading snapshot '{filename}': {e}")
+        return False
+
+
+class SnapshotWriter:
+    """Schreibt im Hintergrund periodisch Snapshots; unveränderter Zustand wird nicht neu geschrieben (SD-Karte)."""
+
+    def __init__(self, filename=SNAPSHOT_FILE, interval=SNAPSHOT_INTERVAL):
+        self.filename = filename
+        self.interval = interval
+        self._last_state = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._Run, name="snapshot-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.Flush)
+
+    def Flush(self):
+        try:
+            snap = BuildSnapshot()
+            state = {k: v for k, v in snap.items() if k != "saved_at"}
+            if state != self._last_state:
+                SaveSnapshot(self.filename, snap)
+                self._last_state = state
+        except Exception as e:
+            print(f"Fehler beim Schreiben des Snapshots: {e}")
+
+    def _Run(self):
+        while not self._stop.wait(self.interval):
+            self.Flush()
+# endregion
+
+# --- Geteilter Flotten-Zustand (Shared Memory) ------------------------
+# region
+SHM_NAME = os.environ.get("GREENTHUMB_SHM_NAME", "greenthumb_fleet")
+SHM_PUBLISH = os.environ.get("GREENTHUMB_SHM_PUBLISH", "") not in ("", "0")     # Backend-Prozess schreibt
+SHM_MAX_MODULES = int(os.environ.get("GREENTHUMB_SHM_MAX_MODULES", "256"))     # feste Größe des Segments
+SHM_META_BYTES = 256 * 1024     # JSON mit Namen/Tankvolumen, wird nur bei Strukturänderungen neu geschrieben
+SHM_PUBLISH_INTERVAL = 0.5      # Sekunden
+SHM_READ_RETRIES = 100
+SHM_REATTACH_CHECK = 2.0        # Sekunden; so oft prüft ein Leser, ob unter dem Namen ein neues Segment liegt
+SHM_MAGIC = 0x47544853          # "GTHS"
+SHM_LAYOUT_VERSION = 2
+# Header (uint64): magic, layout_version, seq, max_modules, meta_version, meta_len, field_crc, boot_id,
+# published_at (float64-Bits). boot_id ist pro angelegtem Segment zufällig (Neustart des Backends erkennen).
+SHM_HEADER_SLOTS = 9
+
+
+def _SharedLayout(max_modules):
+    """Feste Aufteilung des Segments: Header, je Feld eine Spalte, Meta-JSON. Identisch für Schreiber und Leser."""
+    fields = [("module_id", "i4", max_modules), ("version", "u8", max_modules)]
+    fields += [(f, "i1" if isinstance(fill, int) else "f8", max_modules) for f, fill in FleetState.MODULE_FIELDS.items()]
+    fields += [(f, "i1" if isinstance(fill, int) else "f8", max_modules * POTS_PER_MODULE)
+               for f, fill in FleetState.POT_FIELDS.items()]
+    offset = data_start = SHM_HEADER_SLOTS * 8
+    columns = {}
+    for name, dtype, count in fields:
+        columns[name] = (offset, dtype, count)
+        offset += -(-count * int(dtype[1]) // 8) * 8      # 8-Byte-Ausrichtung
+    crc = zlib.crc32(repr(fields).encode())
+    return {"columns": columns, "data_start": data_start, "data_end": offset, "meta": offset,
+            "size": offset + SHM_META_BYTES, "crc": crc}
+
+
+def _AttachSharedMemory(name):
+    from multiprocessing import shared_memory, resource_tracker
+    shm = shared_memory.SharedMemory(name=name)
+    # Bis Python 3.12 meldet auch ein reines Attach das Segment beim resource_tracker an,
+    # der es beim Prozessende löschen würde (außer im Schreiber-Prozess selbst, dem gehört es)
+    if shared_fleet is None or shared_fleet.name != name:
+        try:
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except Exception:
+            pass
+    return shm
+
+
+class SharedFleetPublisher:
+    """Schreibt die FleetState-Spalten periodisch in ein Shared-Memory-Segment fester Größe (Seqlock).
+
+    Nur dieser Prozess schreibt: seq wird vor dem Schreiben ungerade und danach wieder gerade.
+    Jede Modul-Zeile hat eine eigene Versionsnummer, die bei jeder Wertänderung hochzählt.
+    """
+
+    def __init__(self, name=SHM_NAME, max_modules=SHM_MAX_MODULES):
+        from multiprocessing import shared_memory
+        self.name = name
+        self.max_modules = max_modules
+        self.layout = _SharedLayout(max_modules)
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=self.layout["size"])
+        except FileExistsError:
+            # Überbleibsel eines abgestürzten Prozesses: verwerfen und neu anlegen
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=self.layout["size"])
+        buf = self.shm.buf
+        self.header = np.ndarray(SHM_HEADER_SLOTS, dtype="u8", buffer=buf)
+        self.published_at = np.ndarray(1, dtype="f8", buffer=buf, offset=(SHM_HEADER_SLOTS - 1) * 8)
+        self.cols = {name: np.ndarray(count, dtype=dtype, buffer=buf, offset=off)
+                     for name, (off, dtype, count) in self.layout["columns"].items()}
+        self.cols["module_id"][:] = -1
+        self.boot_id = int.from_bytes(os.urandom(8), "little")
+        self.header[:8] = [SHM_MAGIC, SHM_LAYOUT_VERSION, 0, max_modules, 0, 0, self.layout["crc"], self.boot_id]
+        self._meta = None
+        self._warned = False
+        self._stop = threading.Event()
+        self._thread = None
+        atexit.register(self.Close)
+
+    def Start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._Run, name="shm-publisher", daemon=True)
+            self._thread.start()
+
+    def _Run(self):
+        while not self._stop.wait(SHM_PUBLISH_INTERVAL):
+            try:
+                self.Publish()
+            except Exception as e:
+                print(f"Fehler beim Veröffentlichen des Flotten-Zustands: {e}")
+
+    def _Collect(self):
+        # Neue Spaltenwerte und Meta-JSON außerhalb des Schreibfensters zusammenstellen
+        n = self.max_modules
+        new = {"module_id": np.full(n, -1, dtype="i4")}
+        meta = {}
+        with Fleet._lock:
+            rows = dict(Fleet.rows)
+            if Fleet.allocated:
+                m = min(Fleet.capacity, n)
+                for field in FleetState.MODULE_FIELDS:
+                    col = self.cols[field].copy()
+                    col[:m] = getattr(Fleet, field)[:m]
+                    new[field] = col
+                for field in FleetState.POT_FIELDS:
+                    col = self.cols[field].copy()
+                    col[:m * POTS_PER_MODULE] = getattr(Fleet, field)[:m * POTS_PER_MODULE]
+                    new[field] = col
+        for module_id, row in rows.items():
+            module = Modules.get(module_id)
+            if row >= n or module is None:
+                if row >= n and not self._warned:
+                    print(f"Shared Memory: mehr als {n} Module, weitere werden nicht veröffentlicht")
+                    self._warned = True
+                continue
+            new["module_id"][row] = module_id
+            meta[str(module_id)] = {"row": row, "name": module.name, "tank_capacity": module.TankCapacity,
+                                    "pots": {str(pos): pot.name for pos, pot in list(module.pots.items())}}
+        return new, json.dumps(meta, sort_keys=True, separators=(",", ":"))
+
+    def _ChangedRows(self, new):
+        changed = new["module_id"] != self.cols["module_id"]
+        for field, col in new.items():
+            if field == "module_id":
+                continue
+            old = self.cols[field]
+            diff = old != col
+            if col.dtype.kind == "f":
+                diff &= ~(np.isnan(old) & np.isnan(col))
+            changed |= diff.reshape(self.max_modules, -1).any(axis=1)
+        return changed
+
+    def Publish(self):
+        if not Fleet.allocated and self._meta is not None:
+            return
+        new, meta = self._Collect()
+        changed = self._ChangedRows(new)
+        meta_bytes = meta.encode() if meta != self._meta else None
+        if meta_bytes is not None and len(meta_bytes) > SHM_META_BYTES:
+            print(f"Shared Memory: Meta-Daten zu groß ({len(meta_bytes)} Bytes), Namen nicht aktualisiert")
+            meta_bytes = None
+        if not changed.any() and meta_bytes is None:
+            return False
+
+        header = self.header
+        header[2] += 1          # ungerade: Schreiben läuft
+        for field, col in new.items():
+            self.cols[field][:] = col
+        self.cols["version"][changed] += 1
+        if meta_bytes is not None:
+            off = self.layout["meta"]
+            self.shm.buf[off:off + len(meta_bytes)] = meta_bytes
+            header[5] = len(meta_bytes)
+            header[4] += 1
+            self._meta = meta
+        self.published_at[0] = clock.Time()
+        header[2] += 1          # gerade: konsistent
+        MetricInc("shm.published")
+        return True
+
+    def Close(self):
+        self._stop.set()
+        if self.shm is not None:
+            self.header[0] = 0      # Leser, die das Segment noch gemappt haben, sehen sofort: Schreiber weg
+            self.header = self.published_at = None
+            self.cols = {}
+            self.shm.close()
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+            self.shm = None
+
+
+class SharedFleetReader:
+    """Lesender Zugriff für Dashboard-Prozesse: keine Locks, kein IPC-Roundtrip.
+
+    Snapshot() kopiert den Datenbereich einmal (memcpy) und prüft über den Seqlock,
+    dass der Schreiber währenddessen nicht aktiv war; sonst wird wiederholt.
+    Nach einem Neustart des Backends liegt unter demselben Namen ein neues Segment (andere boot_id),
+    der Leser hängt sich dann automatisch um, statt im verwaisten Mapping eingefrorene Daten zu lesen.
+    """
+
+    def __init__(self, name=SHM_NAME):
+        _ImportNumpy()
+        if np is None:
+            raise RuntimeError("Shared Memory benötigt NumPy")
+        self.name = name
+        self.shm = None
+        self._Attach(_AttachSharedMemory(name))
+
+    def _Attach(self, shm):
+        header = np.ndarray(SHM_HEADER_SLOTS, dtype="u8", buffer=shm.buf)
+        published_at = np.ndarray(1, dtype="f8", buffer=shm.buf, offset=(SHM_HEADER_SLOTS - 1) * 8)
+        # Segment ist technisch beschreibbar gemappt, die Sichten des Lesers nicht
+        header.flags.writeable = published_at.flags.writeable = False
+        error = None
+        if header[0] != SHM_MAGIC or header[1] != SHM_LAYOUT_VERSION:
+            error = f"Segment {self.name} hat ein unbekanntes Format"
+        else:
+            layout = _SharedLayout(int(header[3]))
+            if header[6] != layout["crc"]:
+                error = f"Segment {self.name} passt nicht zu dieser backend.py-Version"
+        if error is not None:
+            del header, published_at
+            shm.close()
+            raise ValueError(error)
+        if self.shm is not None:
+            self.Close()
+        self.shm, self.header, self.published_at, self.layout = shm, header, published_at, layout
+        self.boot_id = int(header[7])
+        self._checked = systime.monotonic()
+        self._meta_version = None
+        self._meta = {}
+
+    def _CheckGeneration(self):
+        # Sofort, wenn der Schreiber sein Segment geschlossen hat, sonst alle SHM_REATTACH_CHECK Sekunden
+        closed = self.header[0] != SHM_MAGIC
+        if not closed and systime.monotonic() - self._checked < SHM_REATTACH_CHECK:
+            return
+        self._checked = systime.monotonic()
+        try:
+            shm = _AttachSharedMemory(self.name)
+        except FileNotFoundError:
+            if closed:
+                raise FileNotFoundError(f"Backend hat Segment {self.name} geschlossen")
+            return      # Schreiber abgestürzt: alter Stand bleibt lesbar, published_at zeigt das Alter
+        if int(np.ndarray(1, dtype="u8", buffer=shm.buf, offset=7 * 8)[0]) == self.boot_id:
+            shm.close()
+            return
+        self._Attach(shm)
+        MetricInc("shm.reattached")
+
+    def Snapshot(self):
+        """{"seq", "published_at", "modules": {module_id: {..., "pots": {pos: {...}}}}} oder None bei Dauer-Schreiben."""
+        self._CheckGeneration()
+        layout, header, buf = self.layout, self.header, self.shm.buf
+        for _ in range(SHM_READ_RETRIES):
+            seq = int(header[2])
+            if seq & 1:
+                systime.sleep(0)
+                continue
+            data = bytes(buf[layout["data_start"]:layout["data_end"]])
+            published_at = float(self.published_at[0])
+            meta_version, meta_len = int(header[4]), int(header[5])
+            meta = bytes(buf[layout["meta"]:layout["meta"] + meta_len]) if meta_version != self._meta_version else None
+            if int(header[2]) != seq:
+                continue
+            if meta is not None:
+                self._meta = json.loads(meta) if meta else {}
+                self._meta_version = meta_version
+            return {"seq": seq, "published_at": published_at, "modules": self._Decode(data)}
+        return None
+
+    def _Decode(self, data):
+        start = self.layout["data_start"]
+        cols = {name: np.frombuffer(data, dtype=dtype, count=count, offset=off - start)
+                for name, (off, dtype, count) in self.layout["columns"].items()}
+        modules = {}
+        for module_id, info in self._meta.items():
+            row = info["row"]
+            if cols["module_id"][row] != int(module_id):
+                continue    # Meta und Spalten aus unterschiedlichen Ständen (Modul gerade umgezogen)
+            module = {"name": info["name"], "tank_capacity": info["tank_capacity"], "version": int(cols["version"][row])}
+            module.update({f: _NanToNone(cols[f][row].item()) for f in FleetState.MODULE_FIELDS})
+            pots = {}
+            for pos, pot_name in info["pots"].items():
+                idx = row * POTS_PER_MODULE + int(pos) - 1
+                if not cols["active"][idx]:
+                    continue
+                pot = {"name": pot_name}
+                pot.update({f: cols[f][idx].item() for f in FleetState.POT_FIELDS})
+                pot.update({f: _NanToNone(pot[f]) for f in ("moist_raw", "last_watered")})
+                pot["mode"] = CONTROL_MODES[pot["mode"]]
+                pots[int(pos)] = pot
+            module["pots"] = pots
+            modules[int(module_id)] = module
+        return modules
+
+    def Close(self):
+        self.header = self.published_at = None
+        self.shm.close()
+        self.shm = None
+
+
+shared_fleet = None     # SharedFleetPublisher, wird in start() angelegt, falls GREENTHUMB_SHM_PUBLISH gesetzt ist
+# endregion
+
+# --- Deklarative Flotten-Konfiguration --------------------------------
+# region
+FLEET_CONFIG_FILE = "fleet.json"
+POT_SETTINGS = ("control_mode", "wat_amount", "wat_event_cyc", "moist_thresh")
+
+
+def LoadFleetConfig(filename=FLEET_CONFIG_FILE):
+    if not os.path.isfile(filename):
+        return None
+    with open(filename, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _PotSettings(pot_cfg, presets):
+    # Preset liefert die Basis, Felder direkt am Pot überschreiben sie
+    settings = {"control_mode": "time", "wat_amount": 250.0, "wat_event_cyc": 60.0, "moist_thresh": 20}
+    if pot_cfg.get("preset"):
+        preset = presets.get(pot_cfg["preset"]) or Presets.Get(pot_cfg["preset"]) or {}
+        settings.update({k: preset[k] for k in POT_SETTINGS if k in preset})
+    settings.update({k: pot_cfg[k] for k in POT_SETTINGS if k in pot_cfg})
+    # Durch dieselben Encoder wie die Fleet-Spalten schicken (z.B. moist_thresh 20.5 -> 20), sonst unterscheidet
+    # sich ein unveränderter Pot beim Vergleich mit PresetData() bei jedem Apply
+    for k in POT_SETTINGS:
+        column = Pot.__dict__.get(k)
+        if isinstance(column, _Column):
+            settings[k] = column.decode(column.encode(settings[k]))
+    return settings
+
+
+def ApplyFleetConfig(cfg, remove_missing=True):
+    """Gleicht die laufenden Module/Pots mit cfg ab und ändert nur, was sich unterscheidet.
+
+    cfg = {"presets": {name: {...}},
+           "modules": [{"id", "name", "tank_capacity", "calibration": {"min", "max"},
+                        "pots": [{"pos", "name", "preset", <POT_SETTINGS>, "calibration": {...}}]}]}
+    Unveränderte Pots behalten ihren Scheduler-Termin; neue werden mit einem ScheduleMany eingeplant.
+    """
+    stats = {"modules_added": 0, "modules_removed": 0, "pots_added": 0, "pots_updated": 0,
+             "pots_removed": 0, "rescheduled": 0, "presets_saved": 0, "calibrations": 0}
+    presets = cfg.get("presets", {})
+    known = set(Presets.Names()) if presets else set()
+    changed_presets = {name: data for name, data in presets.items() if name not in known or Presets.Get(name) != data}
+    if changed_presets:
+        Presets.SaveMany(changed_presets)
+        stats["presets_saved"] = len(changed_presets)
+
+    wanted = {m["id"]: m for m in cfg.get("modules", [])}
+    if remove_missing:
+        for module_id in [m for m in Modules if m not in wanted]:
+            RemoveModule(module_id)
+            stats["modules_removed"] += 1
+
+    to_schedule = []
+    calibrations = {}
+    for module_id, m_cfg in wanted.items():
+        module = Modules.get(module_id)
+        if module is None:
+            module = AddModule(module_id, m_cfg.get("name", f"Modul {module_id}"), verbose=False)
+            stats["modules_added"] += 1
+        elif m_cfg.get("name") and module.name != m_cfg["name"]:
+            module.name = m_cfg["name"]
+        if "tank_capacity" in m_cfg:
+            module.TankCapacity = float(m_cfg["tank_capacity"])
+        if "calibration" in m_cfg:
+            calibrations[(module_id, TANK_SENSOR_POS)] = m_cfg["calibration"]
+
+        pots_cfg = {p["pos"]: p for p in m_cfg.get("pots", [])}
+        if remove_missing:
+            for pos in [p for p in module.pots if p not in pots_cfg]:
+                module.DeletePot(pos)
+                stats["pots_removed"] += 1
+
+        for pos, p_cfg in pots_cfg.items():
+            settings = _PotSettings(p_cfg, presets)
+            pot = module.pots.get(pos)
+            if pot is None:
+                pot = module.AddPot(pos, p_cfg.get("name", f"Pflanze {pos}"), settings["control_mode"], settings["wat_amount"],
+                                    settings["wat_event_cyc"], settings["moist_thresh"], schedule=False, verbose=False)
+                to_schedule.append((pot.JobKey(), pot, pot.wat_event_cyc * 60, WaterPots))
+                stats["pots_added"] += 1
+            else:
+                current = pot.PresetData()
+                if p_cfg.get("name") and pot.name != p_cfg["name"]:
+                    pot.name = p_cfg["name"]
+                if any(current[k] != settings[k] for k in POT_SETTINGS):
+                    pot.ApplyPresetData(settings)
+                    stats["pots_updated"] += 1
+                    if current["wat_event_cyc"] != pot.wat_event_cyc:
+                        to_schedule.append((pot.JobKey(), pot, pot.wat_event_cyc * 60, WaterPots))
+            if "calibration" in p_cfg:
+                calibrations[(module_id, pos)] = p_cfg["calibration"]
+
+    stats["rescheduled"] = scheduler.ScheduleMany(to_schedule)
+    if calibrations:
+        stats["calibrations"] = Calibration.Update(calibrations)
+        for (module_id, pos) in calibrations:
+            module = Modules[module_id]
+            if pos == TANK_SENSOR_POS:
+                module.TankLvlMin, module.TankLvlMax = Calibration.Bounds(module_id, pos)
+            elif pos in module.pots:
+                module.pots[pos].moist_min, module.pots[pos].moist_max = Calibration.Bounds(module_id, pos)
+    print(f"Fleet config applied: {stats}")
+    return stats
+
+
+def ExportFleetConfig():
+    """Aktueller Zustand als Konfiguration (Ausgangspunkt für fleet.json)."""
+    modules = []
+    for module in list(Modules.values()):
+        m_cfg = {"id": module.module_id, "name": module.name, "tank_capacity": module.TankCapacity, "pots": []}
+        if (module.module_id, TANK_SENSOR_POS) in Calibration.data:
+            m_cfg["calibration"] = Calibration.data[(module.module_id, TANK_SENSOR_POS)]
+        for pot in list(module.pots.values()):
+            p_cfg = {"pos": pot.module_pos, "name": pot.name, **pot.PresetData()}
+            if (module.module_id, pot.module_pos) in Calibration.data:
+                p_cfg["calibration"] = Calibration.data[(module.module_id, pot.module_pos)]
+            m_cfg["pots"].append(p_cfg)
+        modules.append(m_cfg)
+    return {"modules": modules}
+# endregion
+
+# --- Start ------------------------------------------------------------
 # region 
-AddModule(1, "Fensterbank")
-AddModule(2, "Regal")
+Profiler.Record("import backend", systime.perf_counter() - _IMPORT_T0)
+snapshot_writer = None
+_started = False
+_start_lock = threading.Lock()
+
+
+def start():
+    """Verbindungen, Threads und Zustand hochfahren; der Import von backend hat keine Nebenwirkungen mehr.
+
+    Mehrfache Aufrufe (z.B. bei jedem Streamlit-Rerun) sind wirkungslos.
+    """
+    global pool, snapshot_writer, buffer_processor, Capture, shared_fleet, _started
+    with _start_lock:
+        if _started:
+            return
+        with Profiler.Phase("import paho"):
+            import paho.mqtt.client
+        with Profiler.Phase("import numpy"):
+            _ImportNumpy()
+        with Profiler.Phase("calibration"):
+            Calibration.Load()
+        with Profiler.Phase("mqtt pool"):
+            pool = ConnectionPool(MQTT_BROKERS)
+            pool.Register(TopicRoutes)
+            pool.ConnectAll()
+        # Reihenfolge: Snapshot bringt Messwerte zurück, fleet.json (falls vorhanden) gibt die Struktur vor
+        with Profiler.Phase("snapshot"):
+            restored = LoadSnapshot()
+        with Profiler.Phase("fleet config"):
+            fleet_config = LoadFleetConfig()
+            if fleet_config is not None:
+                ApplyFleetConfig(fleet_config)
+            elif not restored:
+                # --- instantiate objects, TO BE REPLACED BY UI INPUT!!! ---
+                AddModule(1, "Fensterbank")
+                AddModule(2, "Regal")
 
-Modules[1].AddPot(1, "Orchidee", "time", 250, 60, 15)
-Modules[1].AddPot(2, "Kaktus", "moist", 100, 20, 0)
-Modules[2].AddPot(3, "Monstera", "moist", 1400, 10, 15)
+                Modules[1].AddPot(1, "Orchidee", "time", 250, 60, 15)
+                Modules[1].AddPot(2, "Kaktus", "moist", 100, 20, 0)
+                Modules[2].AddPot(3, "Monstera", "moist", 1400, 10, 15)
+        if CAPTURE_FILE:
+            Capture = TrafficCapture(CAPTURE_FILE, ExportFleetConfig())
+            print(f"MQTT-Mitschnitt nach {CAPTURE_FILE}")
+        with Profiler.Phase("threads"):
+            scheduler.Start()
+            buffer_processor = BufferProcessor()
+            snapshot_writer = SnapshotWriter()
+        if SHM_PUBLISH:
+            with Profiler.Phase("shared memory"):
+                if np is None:
+                    print("Shared Memory benötigt NumPy, Veröffentlichung deaktiviert")
+                else:
+                    shared_fleet = SharedFleetPublisher()
+                    shared_fleet.Publish()
+                    shared_fleet.Start()
+                    print(f"Flotten-Zustand in Shared Memory '{SHM_NAME}' veröffentlicht")
+        _started = True
+    Profiler.Report()
 # endregion
 
 # --- Main ------------------------------------------------------------
 if __name__ == "__main__":
+    start()
     print("Bewässerungssystem gestartet...")
 
+    # Empfangspuffer, Scheduler und Snapshots laufen in eigenen Threads
     try:
         while True:
-            for module in Modules.values():
-                while module.MQTT_buffer:
-                    msg = module.MQTT_buffer.pop(0)
-                    ProcessBufferData(module, msg)
             systime.sleep(1)
 
 
     except KeyboardInterrupt:
         print("Beende...")
-        client.disconnect()
+        pool.DisconnectAll()
 
     except Exception as e:
         print(f"Fehler in main loop: {e}")
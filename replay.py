@@ -0,0 +1,122 @@
+# replay.py
+# Spielt einen MQTT-Mitschnitt (GREENTHUMB_CAPTURE=capture.jsonl.gz python backend.py) deterministisch
+# durch die echte Verarbeitung in backend.py: on_message -> Puffer -> ProcessBufferData, Scheduler-Timer
+# und Alarme laufen auf einer FakeClock. Es wird keine Broker-Verbindung aufgebaut.
+#
+#   python replay.py capture.jsonl.gz                 # so schnell wie möglich
+#   python replay.py capture.jsonl.gz --speed 1       # Echtzeit, --speed 10 = 10x
+#   python replay.py capture.jsonl.gz --expect <digest>   # Regressionstest, Exit-Code 1 bei Abweichung
+
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time as systime
+
+import backend
+
+
+class ReplayMessage:
+    # Minimaler Ersatz für paho.mqtt.client.MQTTMessage
+    __slots__ = ("topic", "payload")
+
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload.encode("utf-8")
+
+
+class ReplaySink:
+    """Ersetzt den ConnectionPool: ausgehende Befehle werden mit Zeitstempel der FakeClock gesammelt."""
+
+    def __init__(self):
+        self.sent = []      # (t, topic, payload)
+
+    def Submit(self, module_id, topic, payload, qos=1):
+        self.sent.append((backend.clock.Time(), topic, payload))
+        backend.OnCommandPublished(module_id, payload)
+        return True
+
+
+def AdvanceTo(t):
+    # Uhr von Termin zu Termin vorstellen, damit Timer in Lücken des Mitschnitts nicht als verpasst gelten
+    fired = 0
+    while True:
+        due = backend.scheduler.NextDue()
+        if due is None or due > t:
+            break
+        backend.clock.Set(due)
+        fired += backend.scheduler.RunDue()
+    backend.clock.Set(t)
+    return fired
+
+
+def Digest(sink):
+    # Fingerabdruck über alle ausgehenden Befehle und den Endzustand, unabhängig von der Abspielgeschwindigkeit
+    state = {
+        "sent": sink.sent,
+        "modules": [{"id": m.module_id, "tank": m.TankLvl,
+                     "pots": [[p.module_pos, p.moist_value, p.moist_raw] for p in m.pots.values()]}
+                    for m in backend.Modules.values()],
+        "alerts": sorted([list(k), v["since"]] for k, v in backend.Alerts.Active().items()),
+        "ledger": backend.Ledger.State(),
+    }
+    return hashlib.sha256(json.dumps(state, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def Replay(filename, speed=0.0, verbose=False):
+    header, records = backend.ReadCapture(filename)
+    backend.clock = backend.FakeClock(header["t"])
+    sink = ReplaySink()
+    stats = {"in": 0, "out_captured": 0, "processed": 0, "timers": 0}
+    out = sys.stdout if verbose else open(os.devnull, "w")
+
+    # Kalibrier-Antworten im Mitschnitt dürfen die calibration.json im Arbeitsverzeichnis nicht verändern
+    with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(out):
+        backend.Calibration = backend.CalibrationStore(os.path.join(tmp, "calibration.json"))
+        backend.ApplyFleetConfig(header["fleet"])
+        backend.pool = sink
+
+        t_prev = header["t"]
+        t0 = systime.perf_counter()
+        for t, direction, topic, payload in records:
+            if speed > 0 and t > t_prev:
+                systime.sleep((t - t_prev) / speed)
+            t_prev = max(t_prev, t)
+            stats["timers"] += AdvanceTo(t)
+            if direction == "in":
+                backend.on_message(None, None, ReplayMessage(topic, payload))
+                stats["processed"] += backend.ProcessBuffers()
+                stats["in"] += 1
+            else:
+                stats["out_captured"] += 1
+        elapsed = systime.perf_counter() - t0
+
+    stats["out_replayed"] = len(sink.sent)
+    stats["seconds"] = round(elapsed, 3)
+    stats["msgs_per_s"] = round(stats["in"] / elapsed, 1) if elapsed > 0 else None
+    stats["capture_span_s"] = round(t_prev - header["t"], 1)
+    return stats, Digest(sink)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MQTT-Mitschnitt deterministisch durch backend.py abspielen")
+    parser.add_argument("capture", help="Mitschnitt-Datei (GREENTHUMB_CAPTURE)")
+    parser.add_argument("--speed", type=float, default=0.0, help="1 = Echtzeit, N = N-fach, 0 = maximal (Standard)")
+    parser.add_argument("--expect", help="erwarteter Digest; Abweichung -> Exit-Code 1")
+    parser.add_argument("--verbose", action="store_true", help="Ausgaben des Backends anzeigen")
+    args = parser.parse_args()
+
+    stats, digest = Replay(args.capture, args.speed, args.verbose)
+    for key, value in stats.items():
+        print(f"{key:<16}{value}")
+    print(f"{'digest':<16}{digest}")
+    if args.expect and args.expect != digest:
+        print("Digest weicht ab!")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
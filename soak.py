@@ -0,0 +1,214 @@
+# soak.py
+# Dauertest für lange Laufzeiten: treibt backend.py mit synthetischem Modul-Verkehr und geplanten
+# Gießvorgängen über Tage simulierter Zeit (FakeClock, kein Broker) und misst dabei den Speicher.
+# Wächst der mit tracemalloc gemessene Speicher nach der Aufwärmphase schneller als das Budget
+# pro simuliertem Tag, endet das Skript mit Exit-Code 1 und zeigt die größten Zuwachs-Stellen.
+#
+#   python soak.py                                # 3 Tage, 20 Module
+#   python soak.py --days 30 --modules 100 --budget-kb 128
+
+import argparse
+import contextlib
+import gc
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time as systime
+import tracemalloc
+from collections import deque
+
+import backend
+from replay import ReplayMessage, AdvanceTo
+
+SOAK_T0 = 1_700_000_000.0       # fester Startzeitpunkt, damit Läufe vergleichbar sind
+ACK_DELAY = 5.0                 # Sekunden bis zur simulierten RespWatering-Quittung
+
+
+class SoakSink:
+    """Ersetzt den ConnectionPool; merkt sich nur Gießbefehle, die noch quittiert werden müssen."""
+
+    def __init__(self):
+        self.sent = 0
+        self.pending_acks = deque()     # (fällig, module_id, pot, amount)
+
+    def Submit(self, module_id, topic, payload, qos=1):
+        self.sent += 1
+        backend.OnCommandPublished(module_id, payload)
+        msg = json.loads(payload)
+        if msg.get("Type") == "RequestWatering":
+            self.pending_acks.append((backend.clock.Time() + ACK_DELAY, module_id, msg["Pot"], msg["Amount"]))
+        return True
+
+
+class SyntheticFleet:
+    """Modul-Verkehr mit Zufallsbewegung: Feuchte sinkt langsam, steigt nach dem Gießen, Tank leert sich."""
+
+    def __init__(self, n_modules, seed):
+        self.rng = random.Random(seed)
+        self.tank = {m: 900.0 for m in range(1, n_modules + 1)}
+        self.moist = {(m, p): self.rng.uniform(300, 800) for m in self.tank for p in range(1, 5)}
+
+    def Config(self):
+        modules = []
+        for m in self.tank:
+            pots = [{"pos": p, "name": f"Pflanze {m}.{p}", "control_mode": "moist" if p % 2 else "time",
+                     "wat_amount": 150, "wat_event_cyc": 30 * p, "moist_thresh": 30,
+                     "calibration": {"min": 0, "max": 1000}} for p in range(1, 5)]
+            modules.append({"id": m, "name": f"Soak {m}", "pots": pots,
+                            "calibration": {"min": 0, "max": 1000}})
+        return {"modules": modules}
+
+    def SensorMessage(self, m):
+        rng = self.rng
+        for p in range(1, 5):
+            self.moist[(m, p)] = max(0.0, self.moist[(m, p)] - rng.uniform(0, 3))
+        return {"Type": "CycSensorValues", "ModuleID": m, "PLvl": int(self.tank[m]), "PRef": 0,
+                **{f"MPot{p}": int(self.moist[(m, p)]) for p in range(1, 5)}}
+
+    def Watered(self, m, p, amount):
+        self.moist[(m, p)] = min(1000.0, self.moist[(m, p)] + amount)
+        self.tank[m] = self.tank[m] - amount / 50 if self.tank[m] > 100 else 900.0   # leer -> nachgefüllt
+
+
+def Rss():
+    # Aktueller Resident Set Size in Bytes (Linux/Raspberry Pi), sonst Spitzenwert aus getrusage
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def Slope(samples):
+    # Lineare Regression Bytes über simulierte Tage
+    n = len(samples)
+    if n < 2:
+        return 0.0
+    mx = sum(x for x, _ in samples) / n
+    my = sum(y for _, y in samples) / n
+    var = sum((x - mx) ** 2 for x, _ in samples)
+    return sum((x - mx) * (y - my) for x, y in samples) / var if var else 0.0
+
+
+def Deliver(topic, data):
+    backend.on_message(None, None, ReplayMessage(topic, json.dumps(data)))
+
+
+def Soak(args):
+    backend.clock = backend.FakeClock(SOAK_T0)
+    if args.history_hours is not None:
+        backend.HISTORY_MAX_AGE = args.history_hours * 3600
+    sim = SyntheticFleet(args.modules, args.seed)
+    sink = SoakSink()
+    samples = []            # (simulierter Tag, traced Bytes, RSS Bytes)
+    baseline = None
+    warmup_end = SOAK_T0 + args.warmup_hours * 3600
+    end = SOAK_T0 + args.days * 86400
+    next_sample = SOAK_T0
+    messages = 0
+
+    tracemalloc.start(args.frames)
+    t_wall = systime.perf_counter()
+    with tempfile.TemporaryDirectory() as tmp, open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        backend.Calibration = backend.CalibrationStore(os.path.join(tmp, "calibration.json"))
+        backend.ApplyFleetConfig(sim.Config())
+        backend.pool = sink
+
+        t = SOAK_T0
+        while t < end:
+            t += args.tick
+            AdvanceTo(t)
+            while sink.pending_acks and sink.pending_acks[0][0] <= t:
+                _, m, p, amount = sink.pending_acks.popleft()
+                sim.Watered(m, p, amount)
+                Deliver(backend.RespTopic(m), {"Type": "RespWatering", "Pot": p, "Flow": amount * 0.95})
+            for m in sim.tank:
+                # Ein Modul fällt regelmäßig eine Stunde aus, damit auch sensor_silent auslöst und wieder aufhebt
+                if m == 1 and (t - SOAK_T0) % 86400 < 3600:
+                    continue
+                Deliver(backend.RespTopic(m), sim.SensorMessage(m))
+                messages += 1
+            # Fremde Topics und unbekannte Typen gehören auch zum Alltag
+            Deliver(f"{backend.MQTT_SuperTOPIC}/Module999/resp", {"Type": "CycSensorValues"})
+            Deliver(backend.RespTopic(1), {"Type": "Debug", "n": messages})
+            backend.ProcessBuffers()
+
+            if t >= next_sample:
+                next_sample += args.sample_hours * 3600
+                gc.collect()
+                traced = tracemalloc.get_traced_memory()[0]
+                day = (t - SOAK_T0) / 86400
+                samples.append((day, traced, Rss()))
+                if t >= warmup_end and baseline is None:
+                    baseline = tracemalloc.take_snapshot()
+                print(f"Tag {day:6.2f}  traced {traced / 1024:9.0f} KiB  RSS {samples[-1][2] / 1024:9.0f} KiB",
+                      file=sys.__stdout__)
+        gc.collect()
+        final = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    steady = [s for s in samples if s[0] * 86400 >= args.warmup_hours * 3600]
+    return {
+        "wall_seconds": systime.perf_counter() - t_wall,
+        "messages": messages,
+        "commands": sink.sent,
+        "traced_per_day": Slope([(d, traced) for d, traced, _ in steady]),
+        "rss_per_day": Slope([(d, rss) for d, _, rss in steady]),
+        "baseline": baseline,
+        "final": final,
+    }
+
+
+def TopGrowth(baseline, final, limit, frames=1):
+    # Mit --frames > 1 nach ganzem Stack gruppieren, damit z.B. json.loads dem Aufrufer zugeordnet wird
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__),
+               tracemalloc.Filter(False, "<frozen importlib._bootstrap*>")]
+    key = "traceback" if frames > 1 else "lineno"
+    stats = final.filter_traces(filters).compare_to(baseline.filter_traces(filters), key)
+    return [s for s in stats if s.size_diff > 0][:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dauertest mit Speicher-Budget für backend.py")
+    parser.add_argument("--days", type=float, default=3.0, help="simulierte Laufzeit in Tagen")
+    parser.add_argument("--modules", type=int, default=20)
+    parser.add_argument("--tick", type=float, default=60.0, help="Sekunden zwischen zwei Sensor-Nachrichten")
+    # Nach der Aufwärmphase müssen die Rohwerte der Historie voll sein (gekürzt wird blockweise ab dem
+    # 1,25-fachen von HISTORY_RAW_AGE), danach wachsen nur noch die Min/Max-Buckets
+    parser.add_argument("--warmup-hours", type=float, default=backend.HISTORY_RAW_AGE * 1.25 / 3600 + 2,
+                        help="Aufwärmphase, zählt nicht zum Budget")
+    parser.add_argument("--history-hours", type=float, default=None,
+                        help="Historie-Aufbewahrung (Standard: wie im Betrieb, HISTORY_MAX_AGE)")
+    parser.add_argument("--sample-hours", type=float, default=2.0, help="Abstand der Speicher-Messungen")
+    parser.add_argument("--budget-kb", type=float, default=256.0, help="erlaubter Zuwachs (tracemalloc) pro Tag")
+    parser.add_argument("--rss-budget-kb", type=float, default=None, help="optional: erlaubter RSS-Zuwachs pro Tag")
+    parser.add_argument("--frames", type=int, default=1, help="Stack-Tiefe für tracemalloc (größer = langsamer)")
+    parser.add_argument("--top", type=int, default=10, help="Anzahl angezeigter Zuwachs-Stellen")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    if args.warmup_hours >= args.days * 24:
+        parser.error("--days muss länger als die Aufwärmphase sein")
+
+    result = Soak(args)
+    print(f"\n{result['messages']} Sensor-Nachrichten, {result['commands']} Befehle in {result['wall_seconds']:.1f} s")
+    print(f"Zuwachs pro Tag: traced {result['traced_per_day'] / 1024:.1f} KiB (Budget {args.budget_kb:.0f} KiB), "
+          f"RSS {result['rss_per_day'] / 1024:.1f} KiB")
+    print("\nGrößte Zuwächse seit Ende der Aufwärmphase:")
+    for stat in TopGrowth(result["baseline"], result["final"], args.top, args.frames):
+        print(f"  {stat}")
+        if args.frames > 1:
+            for line in stat.traceback.format(limit=args.frames):
+                print(f"      {line}")
+
+    failed = result["traced_per_day"] > args.budget_kb * 1024
+    if args.rss_budget_kb is not None and result["rss_per_day"] > args.rss_budget_kb * 1024:
+        failed = True
+    print("\nFEHLGESCHLAGEN: Speicher wächst über Budget" if failed else "\nOK")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()